@@ -0,0 +1,37 @@
+"""Per-user cache directory
+
+Files are stored under `$XDG_CACHE_HOME/reven2-ltrace/v<CACHE_VERSION>`,
+bump CACHE_VERSION when the format of a cached file changes.
+"""
+
+import os
+
+CACHE_VERSION = 1
+
+# set to None to disable caching
+cache_root = os.path.join(
+    os.environ.get("XDG_CACHE_HOME")
+    or os.path.join(os.path.expanduser("~"), ".cache"),
+    "reven2-ltrace",
+)
+
+
+def cache_dir(*parts):
+    """Return the cache directory for parts, or None if caching is disabled"""
+    if cache_root is None:
+        return None
+
+    path = os.path.join(cache_root, "v{}".format(CACHE_VERSION), *parts)
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError:
+        return None
+    return path
+
+
+def replace_file(path, write):
+    """Atomically replace path with the content written by write(file)"""
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
@@ -0,0 +1,140 @@
+"""Select the calls to decode by binary and symbol name
+
+Patterns are globs, or regexes between slashes, prefixed with `!` to
+exclude the matching calls:
+- `CreateFileW`, `Reg*`: globs without `!` match the symbol name
+- `kernel32!*File*`: globs with `!` match the binary name before the
+  first `!` and the symbol name after it
+- `/^ntdll!Nt/`: regexes are searched in `binary!symbol`
+- `!*Heap*`: exclude the matching calls
+
+A call is selected when it matches one of the include patterns, if any,
+and none of the exclude patterns. Globs are case insensitive. Symbol
+names are demangled, as displayed. Binary names match with or without
+their extension: `kernel32!*` and `kernel32.dll!*` both select the calls
+to kernel32.dll, whether ossi names it `kernel32.dll` or `kernel32`.
+"""
+
+import fnmatch
+import re
+
+from .prototypes import demangle
+
+
+UNKNOWN = "<unknown>"
+
+_BINARY_EXTENSIONS = (".dll", ".exe", ".sys", ".drv")
+
+
+def _strip_extension(name):
+    """Return the binary name without its extension, if a known one"""
+    if name.lower().endswith(_BINARY_EXTENSIONS):
+        return name[: name.rindex(".")]
+    return name
+
+
+def _binary_names(binary):
+    """Return the names binary patterns are matched against"""
+    stripped = _strip_extension(binary)
+    return (binary,) if stripped == binary else (binary, stripped)
+
+
+def _glob(pattern):
+    return re.compile(fnmatch.translate(pattern), re.IGNORECASE)
+
+
+def _binary_matcher(pattern):
+    """Return a function matching binary names against the glob pattern"""
+    regex = _glob(pattern)
+    stripped = _strip_extension(pattern)
+    # names without extension also match the patterns with one
+    bare = _glob(stripped) if stripped != pattern else None
+
+    def match(binary):
+        names = _binary_names(binary)
+        if any(regex.match(name) is not None for name in names):
+            return True
+        return (
+            bare is not None
+            and len(names) == 1
+            and bare.match(binary) is not None
+        )
+
+    return match
+
+
+def parse_pattern(pattern):
+    """Return (exclude, function matching (binary, symbol)) of pattern"""
+    exclude = pattern.startswith("!")
+    if exclude:
+        pattern = pattern[1:]
+
+    if len(pattern) >= 2 and pattern.startswith("/") and pattern.endswith("/"):
+        try:
+            regex = re.compile(pattern[1:-1])
+        except re.error as e:
+            raise ValueError("Invalid regex `{}`: {}".format(pattern, e))
+        return (
+            exclude,
+            lambda binary, symbol: any(
+                regex.search(name + "!" + symbol) is not None
+                for name in _binary_names(binary)
+            ),
+        )
+
+    if not pattern:
+        raise ValueError("Empty pattern")
+    if "!" in pattern:
+        binary_pattern, _, symbol_pattern = pattern.partition("!")
+        match_binary = _binary_matcher(binary_pattern)
+        regex = _glob(symbol_pattern)
+        return (
+            exclude,
+            lambda binary, symbol: regex.match(symbol) is not None
+            and match_binary(binary),
+        )
+    regex = _glob(pattern)
+    return (exclude, lambda binary, symbol: regex.match(symbol) is not None)
+
+
+class CallFilter(object):
+    """Select calls matching the patterns, see the module documentation"""
+
+    def __init__(self, patterns):
+        self._includes = []
+        self._excludes = []
+        for pattern in patterns:
+            exclude, match = parse_pattern(pattern)
+            (self._excludes if exclude else self._includes).append(match)
+        # (binary name, symbol name) -> selected
+        self._selected = {}
+        self.rejected = 0
+
+    def _select(self, binary, symbol):
+        if symbol != UNKNOWN:
+            _, symbol = demangle.msvc_demangle(symbol)
+        if self._includes and not any(
+            match(binary, symbol) for match in self._includes
+        ):
+            return False
+        return not any(match(binary, symbol) for match in self._excludes)
+
+    def selects(self, call):
+        """Return whether the pretty.CallRecord call is selected.
+
+        Only the ossi location and symbol of the call are resolved.
+        """
+        location = call.location
+        symbol = call.symbol
+        key = (
+            location.binary.name
+            if location is not None and location.binary
+            else UNKNOWN,
+            UNKNOWN if symbol is None else symbol.name,
+        )
+        selected = self._selected.get(key)
+        if selected is None:
+            selected = self._selected[key] = self._select(*key)
+        if not selected:
+            self.rejected += 1
+        return selected
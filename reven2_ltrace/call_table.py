@@ -0,0 +1,216 @@
+"""Columnar table of calls, for bulk analysis with NumPy
+
+Requires numpy (`pip install reven2-ltrace[table]`).
+
+Calls are stored as one array per column instead of one object per call.
+Function and binary names are interned: the `function` and `binary`
+columns are indices in the `functions` and `binaries` name arrays.
+
+>>> table = collect_calls(ltrace_pretty_proto(srv, "c:/windows/explorer.exe"))
+>>> peek = table.select(table.calls_to("PeekMessage"))
+>>> peek.count_by("binary")
+[('user32', 1234)]
+>>> table.save("explorer.npz")
+"""
+
+import array
+
+import numpy
+
+from .prototype_formatter import as_uint_value
+
+
+TABLE_VERSION = 1
+
+# number of argument slots of each call, further arguments are dropped
+MAX_ARGS = 8
+
+_UINT64_MASK = (1 << 64) - 1
+
+# marks an unknown ret transition
+NO_RET = -1
+
+# name of the columns, with their dtype
+COLUMNS = (
+    ("call_id", numpy.int64),
+    ("ret_id", numpy.int64),
+    ("function", numpy.int32),
+    ("binary", numpy.int32),
+    ("ret_raw", numpy.uint64),
+    ("arg_count", numpy.int8),
+    ("args", numpy.uint64),
+    ("args_known", numpy.bool_),
+)
+
+# columns whose values are indices in a name array
+_NAMES = {"function": "functions", "binary": "binaries"}
+
+
+def _raw_uint(raw_value):
+    if raw_value is None:
+        return 0
+    return as_uint_value(raw_value) & _UINT64_MASK
+
+
+class CallTable(object):
+    """Calls as NumPy columns.
+
+    `call_id`, `ret_id` (NO_RET if unknown), `function`, `binary`,
+    `ret_raw` and `arg_count` have one value per call. `args` and
+    `args_known` have MAX_ARGS raw argument slots per call, `args_known`
+    is False for unread or missing arguments.
+    """
+
+    def __init__(self, columns, functions, binaries):
+        for name, dtype in COLUMNS:
+            setattr(self, name, numpy.asarray(columns[name], dtype=dtype))
+        self.functions = numpy.asarray(functions, dtype=str)
+        self.binaries = numpy.asarray(binaries, dtype=str)
+
+    def __len__(self):
+        return len(self.call_id)
+
+    def _columns(self):
+        return {name: getattr(self, name) for name, _ in COLUMNS}
+
+    def select(self, rows):
+        """Return the table of rows, a boolean mask or an array of indices"""
+        return CallTable(
+            {name: column[rows] for name, column in self._columns().items()},
+            self.functions,
+            self.binaries,
+        )
+
+    def sort(self, by="call_id"):
+        """Return the table sorted by the column by, keeping ties in order"""
+        return self.select(numpy.argsort(getattr(self, by), kind="stable"))
+
+    def _name_id(self, column, name):
+        ids = numpy.flatnonzero(getattr(self, _NAMES[column]) == name)
+        return ids[0] if len(ids) else None
+
+    def calls_to(self, function, binary=None):
+        """Return the mask of the calls to function, in binary if not None"""
+        function_id = self._name_id("function", function)
+        if function_id is None:
+            return numpy.zeros(len(self), dtype=bool)
+        mask = self.function == function_id
+        if binary is not None:
+            binary_id = self._name_id("binary", binary)
+            if binary_id is None:
+                return numpy.zeros(len(self), dtype=bool)
+            mask &= self.binary == binary_id
+        return mask
+
+    def names(self, column):
+        """Return the names of the function or binary column, per call"""
+        return getattr(self, _NAMES[column])[getattr(self, column)]
+
+    def group_by(self, by):
+        """Return {key: indices of its calls}, keys are names if by is
+        function or binary.
+        """
+        keys, inverse = numpy.unique(getattr(self, by), return_inverse=True)
+        order = numpy.argsort(inverse, kind="stable")
+        bounds = numpy.cumsum(numpy.bincount(inverse))[:-1]
+        if by in _NAMES:
+            keys = getattr(self, _NAMES[by])[keys]
+        return {
+            key.item(): rows
+            for key, rows in zip(keys, numpy.split(order, bounds))
+        }
+
+    def count_by(self, by):
+        """Return [(key, call count)] sorted by decreasing count"""
+        keys, counts = numpy.unique(getattr(self, by), return_counts=True)
+        if by in _NAMES:
+            keys = getattr(self, _NAMES[by])[keys]
+        order = numpy.argsort(-counts, kind="stable")
+        return [(keys[i].item(), counts[i].item()) for i in order]
+
+    def save(self, path):
+        """Save the table in the .npz file at path"""
+        numpy.savez_compressed(
+            path,
+            version=numpy.int32(TABLE_VERSION),
+            functions=self.functions,
+            binaries=self.binaries,
+            **self._columns()
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Load the table saved in the .npz file at path"""
+        with numpy.load(path, allow_pickle=False) as data:
+            if int(data["version"]) != TABLE_VERSION:
+                raise ValueError(
+                    "Unsupported call table version {} in {}".format(
+                        int(data["version"]), path
+                    )
+                )
+            return cls(
+                {name: data[name] for name, _ in COLUMNS},
+                data["functions"],
+                data["binaries"],
+            )
+
+
+def collect_calls(calls, read_args=True):
+    """Return the CallTable of the pretty.CallRecord calls.
+
+    @param calls: iterable of pretty.CallRecord, as yielded by
+        ltrace.ltrace_pretty_proto
+    @param read_args: if False, the arguments are not read
+    """
+    call_ids = array.array("q")
+    ret_ids = array.array("q")
+    functions = array.array("i")
+    binaries = array.array("i")
+    ret_raws = array.array("Q")
+    arg_counts = array.array("b")
+    args = array.array("Q")
+    args_known = array.array("b")
+
+    function_ids = {}
+    binary_ids = {}
+    empty_slots = [0] * MAX_ARGS
+
+    for call in calls:
+        call_ids.append(call.point.id)
+        ret = call.ret
+        ret_point = ret.point
+        ret_ids.append(NO_RET if ret_point is None else ret_point.id)
+        functions.append(
+            function_ids.setdefault(str(call.func), len(function_ids))
+        )
+        binaries.append(
+            binary_ids.setdefault(call.tr.to_bin, len(binary_ids))
+        )
+        ret_raws.append(_raw_uint(ret.raw))
+
+        call_args = call.args[:MAX_ARGS] if read_args else []
+        arg_counts.append(len(call_args))
+        slots = [_raw_uint(arg.raw) for arg in call_args]
+        args.extend(slots + empty_slots[len(slots) :])  # noqa: E203
+        known = [arg.raw is not None for arg in call_args]
+        args_known.extend(known + empty_slots[len(known) :])  # noqa: E203
+
+    def column(values, dtype, width=None):
+        column = numpy.frombuffer(values, dtype=dtype) if values else []
+        column = numpy.asarray(column, dtype=dtype)
+        return column if width is None else column.reshape(-1, width)
+
+    return CallTable(
+        {
+            "call_id": column(call_ids, numpy.int64),
+            "ret_id": column(ret_ids, numpy.int64),
+            "function": column(functions, numpy.int32),
+            "binary": column(binaries, numpy.int32),
+            "ret_raw": column(ret_raws, numpy.uint64),
+            "arg_count": column(arg_counts, numpy.int8),
+            "args": column(args, numpy.uint64, MAX_ARGS),
+            "args_known": column(args_known, numpy.int8, MAX_ARGS),
+        },
+        sorted(function_ids, key=function_ids.get),
+        sorted(binary_ids, key=binary_ids.get),
+    )
@@ -6,18 +6,43 @@ Entrypoints:
    for a binary on a given context range
 - `ltrace_pretty_proto` can be used to yield ltrace information
    for a binary on a given context range
+- `parallel.print_ltrace_parallel` will print the same information
+   using several worker processes
+- `call_table.collect_calls` can store the calls yielded by
+   `ltrace_pretty_proto` in NumPy columns
 """
 
 import argparse
+from sys import stderr
+
 import reven2
 
+from . import cache
+from .call_filter import CallFilter
+from .output import open_output
+from .parallel import print_ltrace_parallel
 from .pretty_print import (
     get_print_func,
-    get_pretty_proto,
+    get_pretty_protos,
     list_print_modes,
+    write_header,
 )
 from .prototypes.call_info import CallInfo
-from .reven.binary_ranges import binary_ranges
+from .prototypes.prototype_db import default_db_path
+from .reven.binary_ranges import (  # noqa: F401
+    binary_ranges,
+    is_last_context,
+    process_filter,
+)
+from .reven.memory_cache import memory_cache
+from .reven.ossi_cache import location_cache
+from .reven.range_index import open_index
+from .reven.return_points import (
+    DEFAULT_PAIRING,
+    PAIRING_MODES,
+    ReturnPoints,
+)
+from .summary import CallSummary
 
 from .resources import (
     msdn_xml,
@@ -27,30 +52,96 @@ from .resources import (
 )
 
 
-def ltrace_pretty_proto(srv, binary_path, from_context=None, to_context=None):
+def ltrace_pretty_proto(
+    srv,
+    binary_path,
+    from_context=None,
+    to_context=None,
+    pairing=DEFAULT_PAIRING,
+    patterns=None,
+    pid=None,
+    process_name=None,
+):
+    """Generate the pretty.CallRecord of each call leaving the binary
+
+    @param patterns: list of str of the call_filter patterns selecting
+        the calls, if None, all calls are generated
+    @see print_ltrace for other parameters
+    """
+    processes = process_filter(pid, process_name)
+    call_filter = CallFilter(patterns) if patterns else None
     ltracer = CallInfo(
-        srv, msdn_xml, msdn_typedefs_conf, ltrace_conf, ltrace_extra_conf
+        srv,
+        msdn_xml,
+        msdn_typedefs_conf,
+        ltrace_conf,
+        ltrace_extra_conf,
+        default_db_path(),
     )
 
-    for tr in ltrace(srv.trace, binary_path, from_context, to_context):
-        # ignore pagefaults
-        if tr.type == reven2.trace.TransitionType.Instruction:
-            yield get_pretty_proto(tr, ltracer)
+    index = open_index(srv, binary_path, processes)
+    returns = ReturnPoints(pairing)
+    calls = ltrace(
+        srv.trace,
+        binary_path,
+        from_context,
+        to_context,
+        index,
+        returns,
+        processes,
+    )
+    yield from get_pretty_protos(
+        calls, ltracer, returns, call_filter=call_filter
+    )
+    ltracer.flush()
 
 
-def is_last_context(trace, context):
-    return context._id == trace.transition_count
+def ltrace(
+    trace,
+    binary_path,
+    from_context=None,
+    to_context=None,
+    index=None,
+    returns=None,
+    processes=None,
+):
+    """Generate transitions leaving the given binary
+
+    If given, binary ranges are read from the range_index.BinaryRangesIndex
+    index instead of being searched, and the transitions are paired with
+    their ret point in the return_points.ReturnPoints returns.
+    If the binary_ranges.ProcessFilter processes is not None, only the
+    binary ranges of the selected processes are searched, index must be
+    restricted to the same processes.
+    """
+    if index is None:
+        ranges = binary_ranges(
+            trace, binary_path, from_context, to_context, processes
+        )
+    else:
+        ranges = index.ranges(from_context, to_context)
 
+    if returns is None:
+        returns = ReturnPoints("memhist")
 
-def ltrace(trace, binary_path, from_context=None, to_context=None):
-    """Generate transitions leaving the given binary"""
-    for _, last in binary_ranges(trace, binary_path, from_context, to_context):
-        if last is not None and not is_last_context(trace, last):
-            yield last.transition_after()
+    memory_cache.bind(trace)
+    location_cache.bind(trace)
+    return returns.calls(trace, ranges)
 
 
 def print_ltrace(
-    srv, binary_path, from_context=None, to_context=None, pretty_mode=None
+    srv,
+    binary_path,
+    from_context=None,
+    to_context=None,
+    pretty_mode=None,
+    pairing=DEFAULT_PAIRING,
+    stats=False,
+    output=None,
+    summary=False,
+    patterns=None,
+    pid=None,
+    process_name=None,
 ):
     """
     Print ltrace information for binary on a context range.
@@ -77,16 +168,123 @@ def print_ltrace(
     @param pretty_mode: str of the pretty mode to be used for display
         @see pretty_print.py
         if None, use default pretty mode
+    @param pairing: str of the mode used to find the ret point of calls
+        @see reven/return_points.py
+    @param stats: if True, print cache statistics on stderr at the end
+    @param output: str of the path of the output file, compressed if it
+        ends with .gz or .xz
+        if None, print to stdout
+    @param summary: if True, print a table of the call count, duration and
+        failures per function at the end instead of each call
+        @see summary.py
+    @param patterns: list of str of the patterns selecting the calls to
+        print, if None, all calls are printed
+        @see call_filter.py
+    @param pid: int of the pid of the process to analyse
+        if None, calls of all processes are printed
+    @param process_name: str of the name of the processes to analyse
+        if None, calls of all processes are printed
     """
+    processes = process_filter(pid, process_name)
     print_info = get_print_func(pretty_mode)
+    call_filter = CallFilter(patterns) if patterns else None
     ltracer = CallInfo(
-        srv, msdn_xml, msdn_typedefs_conf, ltrace_conf, ltrace_extra_conf
+        srv,
+        msdn_xml,
+        msdn_typedefs_conf,
+        ltrace_conf,
+        ltrace_extra_conf,
+        default_db_path(),
     )
 
-    for tr in ltrace(srv.trace, binary_path, from_context, to_context):
-        # ignore pagefaults
-        if tr.type == reven2.trace.TransitionType.Instruction:
-            print_info(tr, ltracer)
+    index = open_index(srv, binary_path, processes)
+    returns = ReturnPoints(pairing)
+    calls = ltrace(
+        srv.trace,
+        binary_path,
+        from_context,
+        to_context,
+        index,
+        returns,
+        processes,
+    )
+    with open_output(output) as out:
+        if summary:
+            call_summary = CallSummary()
+            for call in get_pretty_protos(
+                calls, ltracer, returns, call_filter=call_filter
+            ):
+                call_summary.add(call)
+            call_summary.print_table(out)
+        else:
+            write_header(print_info, out)
+            for call in get_pretty_protos(
+                calls, ltracer, returns, pretty_mode, call_filter
+            ):
+                print_info(call, out)
+    ltracer.flush()
+
+    if stats:
+        print_stats(returns, ltracer, call_filter)
+
+
+def _ratio(part, total):
+    return "{:.1%}".format(part / total) if total else "-"
+
+
+def print_stats(returns, info=None, call_filter=None):
+    """Print statistics of the caches used by ltrace on stderr"""
+    lines = [
+        "locations: {} hits, {} misses ({} hit rate)".format(
+            location_cache.hits,
+            location_cache.misses,
+            _ratio(
+                location_cache.hits,
+                location_cache.hits + location_cache.misses,
+            ),
+        ),
+        "ret points: {} paired, {} from memory history".format(
+            returns.paired, returns.fallbacks
+        ),
+        "memory: {} bytes fetched in {} pages, {} bytes served, "
+        "{} write checks".format(
+            memory_cache.bytes_fetched,
+            memory_cache.pages_read,
+            memory_cache.bytes_served,
+            memory_cache.write_queries,
+        ),
+    ]
+    if info is not None:
+        disk_hits = info.cache_hits
+        lines.append(
+            "prototypes: {} resolved, {} memory hits, {} cache hits "
+            "({} hit rate)".format(
+                info.resolved,
+                info.memory_hits,
+                disk_hits,
+                _ratio(
+                    info.memory_hits + disk_hits,
+                    info.memory_hits + disk_hits + info.resolved,
+                ),
+            )
+        )
+        lines.append(
+            "clang: {} re-parses for unknown types, {} avoided".format(
+                info.proto_parser.reparses, info.proto_parser.reparses_avoided
+            )
+        )
+    if call_filter is not None:
+        lines.append("filter: {} calls skipped".format(call_filter.rejected))
+    resolver = returns.resolver
+    if resolver is not None:
+        lines.append(
+            "ret slots: {} queries, {} cached, {} memhist requests".format(
+                resolver.queries, resolver.cached, resolver.requests
+            )
+        )
+
+    for line in lines:
+        print("STATS: {}".format(line), file=stderr)
 
 
 def parse_cli_args():
@@ -120,11 +318,84 @@ def parse_cli_args():
     parser.add_argument("--from", type=int, help="start at context")
     parser.add_argument("--to", type=int, help="stop at context")
     parser.add_argument("--pretty", type=str, help="output format")
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        help="write to this file instead of stdout, "
+        "compressed if it ends with .gz or .xz",
+    )
+    parser.add_argument(
+        "-e",
+        dest="patterns",
+        action="append",
+        metavar="PATTERN",
+        help="only decode the calls to binary!symbol matching PATTERN, a "
+        "glob or /regex/, or not matching it if prefixed with ! "
+        "(repeatable, see call_filter.py)",
+    )
+    parser.add_argument(
+        "--pid",
+        type=int,
+        help="only trace the calls of the process with this pid",
+    )
+    parser.add_argument(
+        "--process-name",
+        type=str,
+        help="only trace the calls of the processes with this name",
+    )
+    parser.add_argument(
+        "-c",
+        "--summary",
+        action="store_true",
+        help="print the count, duration in transitions and failures of "
+        "the calls per function instead of each call",
+    )
+    parser.add_argument(
+        "--ret-pairing",
+        choices=PAIRING_MODES,
+        default=DEFAULT_PAIRING,
+        help="how to find the ret point of calls (default: {})".format(
+            DEFAULT_PAIRING
+        ),
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of worker processes, 0 for one per cpu (default: 1)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=cache.cache_root,
+        help="directory of the persistent caches (default: {})".format(
+            cache.cache_root
+        ),
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="do not read nor write the persistent caches",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="print cache statistics on stderr at the end (single job)",
+    )
     parser.add_argument(
         "BINARY", nargs="?", help="full path of the binary to ltrace"
     )
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.jobs < 0:
+        parser.error("argument -j/--jobs: must be positive or 0")
+    try:
+        CallFilter(args.patterns or [])
+    except ValueError as e:
+        parser.error(str(e))
+    return args
 
 
 def print_binaries(srv):
@@ -137,6 +408,7 @@ def main():
     host = args.host
     port = args.port
     binary_path = args.BINARY
+    cache.cache_root = None if args.no_cache else args.cache_dir
 
     srv = reven2.RevenServer(host, port)
 
@@ -152,7 +424,39 @@ def main():
     if args.to is not None:
         to_context = srv.trace._context(args.to)
 
-    print_ltrace(srv, binary_path, from_context, to_context, args.pretty)
+    if args.jobs == 1:
+        print_ltrace(
+            srv,
+            binary_path,
+            from_context,
+            to_context,
+            args.pretty,
+            args.ret_pairing,
+            args.stats,
+            args.output,
+            args.summary,
+            args.patterns,
+            args.pid,
+            args.process_name,
+        )
+        return
+
+    print_ltrace_parallel(
+        srv,
+        host,
+        port,
+        binary_path,
+        from_context,
+        to_context,
+        args.pretty,
+        args.ret_pairing,
+        args.jobs or None,
+        args.output,
+        args.summary,
+        args.patterns,
+        args.pid,
+        args.process_name,
+    )
 
 
 if __name__ == "__main__":
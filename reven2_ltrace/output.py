@@ -0,0 +1,42 @@
+"""Output file of ltrace
+
+Outputs go through a large write buffer. Paths ending with `.gz` or `.xz`
+are compressed.
+"""
+
+import contextlib
+import gzip
+import io
+import lzma
+import sys
+
+
+# size of the write buffer of output files
+BUFFER_SIZE = 1 << 20
+
+_compressors = {
+    ".gz": gzip.GzipFile,
+    ".xz": lzma.LZMAFile,
+}
+
+
+@contextlib.contextmanager
+def open_output(path=None):
+    """Yield the text file to write to path, stdout if path is None or -"""
+    if path is None or path == "-":
+        yield sys.stdout
+        sys.stdout.flush()
+        return
+
+    raw = None
+    for extension, compressor in _compressors.items():
+        if path.endswith(extension):
+            raw = compressor(path, "wb")
+            break
+    if raw is None:
+        raw = io.FileIO(path, "wb")
+
+    with io.TextIOWrapper(
+        io.BufferedWriter(raw, BUFFER_SIZE), encoding="utf-8", newline="\n"
+    ) as f:
+        yield f
@@ -0,0 +1,238 @@
+"""Run ltrace on shards of the trace in parallel processes
+
+Each worker process has its own connection to the reven server and
+decodes the calls of one shard at a time. Shard outputs are merged back
+in transition order through a bounded reorder buffer, or merged in a
+single summary. The binary ranges index is built once before the workers
+start, so that they read it instead of searching.
+"""
+
+import collections
+import io
+import multiprocessing
+
+import reven2
+
+from . import cache
+from .call_filter import CallFilter
+from .output import open_output
+from .pretty_print import get_pretty_protos, get_print_func, write_header
+from .prototypes.call_info import CallInfo
+from .prototypes.prototype_db import default_db_path
+from .reven.binary_ranges import process_filter, shard_ranges
+from .reven.memory_cache import memory_cache
+from .reven.ossi_cache import location_cache
+from .reven.range_index import open_index
+from .reven.return_points import DEFAULT_PAIRING, ReturnPoints
+from .summary import CallSummary
+
+from .resources import (
+    msdn_xml,
+    msdn_typedefs_conf,
+    ltrace_conf,
+    ltrace_extra_conf,
+)
+
+
+# do not split the trace in shards smaller than this
+MIN_SHARD_TRANSITIONS = 100000
+
+# number of shards per job, to balance the load between workers
+SHARDS_PER_JOB = 8
+
+# number of shard results waiting to be printed, per job
+PENDING_SHARDS_PER_JOB = 2
+
+
+# per-process worker state, set by _init_worker
+_worker = {}
+
+
+def _init_worker(
+    host,
+    port,
+    binary_path,
+    to_id,
+    pretty_mode,
+    pairing,
+    cache_root,
+    summary,
+    patterns,
+    pid,
+    process_name,
+):
+    cache.cache_root = cache_root
+    srv = reven2.RevenServer(host, port)
+    _worker["srv"] = srv
+    processes = process_filter(pid, process_name)
+    _worker["index"] = open_index(srv, binary_path, processes)
+    _worker["binary_path"] = binary_path
+    _worker["processes"] = processes
+    _worker["to_id"] = to_id
+    _worker["pretty_mode"] = pretty_mode
+    _worker["print_info"] = get_print_func(pretty_mode)
+    _worker["pairing"] = pairing
+    _worker["summary"] = summary
+    _worker["call_filter"] = CallFilter(patterns) if patterns else None
+    _worker["ltracer"] = CallInfo(
+        srv,
+        msdn_xml,
+        msdn_typedefs_conf,
+        ltrace_conf,
+        ltrace_extra_conf,
+        default_db_path(),
+    )
+
+
+def _ltrace_shard(shard_from_id, shard_to_id, first_shard):
+    trace = _worker["srv"].trace
+    to_id = _worker["to_id"]
+    to_context = None if to_id is None else trace._context(to_id)
+    print_info = _worker["print_info"]
+    ltracer = _worker["ltracer"]
+    call_filter = _worker["call_filter"]
+
+    ranges = shard_ranges(
+        trace,
+        _worker["binary_path"],
+        trace._context(shard_from_id),
+        trace._context(shard_to_id),
+        to_context,
+        first_shard,
+        _worker["index"],
+        _worker["processes"],
+    )
+
+    returns = ReturnPoints(_worker["pairing"])
+    memory_cache.bind(trace)
+    location_cache.bind(trace)
+    calls = returns.calls(trace, ranges)
+    if _worker["summary"]:
+        call_summary = CallSummary()
+        for call in get_pretty_protos(
+            calls, ltracer, returns, call_filter=call_filter
+        ):
+            call_summary.add(call)
+        ltracer.flush()
+        return call_summary
+
+    output = io.StringIO()
+    for call in get_pretty_protos(
+        calls, ltracer, returns, _worker["pretty_mode"], call_filter
+    ):
+        print_info(call, output)
+    ltracer.flush()
+
+    return output.getvalue()
+
+
+def split_shards(from_id, to_id, jobs):
+    """Split [from_id, to_id[ in contiguous shards for jobs workers"""
+    if to_id <= from_id:
+        return []
+
+    shard_count = max(
+        1,
+        min(
+            jobs * SHARDS_PER_JOB,
+            (to_id - from_id) // MIN_SHARD_TRANSITIONS,
+        ),
+    )
+    shard_size = -(-(to_id - from_id) // shard_count)
+
+    shards = []
+    for shard_from in range(from_id, to_id, shard_size):
+        shards.append((shard_from, min(shard_from + shard_size, to_id)))
+    return shards
+
+
+def print_ltrace_parallel(
+    srv,
+    host,
+    port,
+    binary_path,
+    from_context=None,
+    to_context=None,
+    pretty_mode=None,
+    pairing=DEFAULT_PAIRING,
+    jobs=None,
+    output=None,
+    summary=False,
+    patterns=None,
+    pid=None,
+    process_name=None,
+):
+    """
+    Print ltrace information for binary on a context range using jobs
+    worker processes.
+
+    @param srv: a connected instance of reven2.RevenServer
+    @param host, port: address of srv, workers open their own connection
+    @param jobs: number of worker processes,
+        if None, use the number of cpus
+    @param output: str of the path of the output file,
+        if None, print to stdout
+    @param summary: if True, print the summary table of the calls instead
+        of each call
+    @param patterns: list of str of the patterns selecting the calls
+    @param pid, process_name: pid and name of the process to analyse
+    @see ltrace.print_ltrace for other parameters
+    """
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+
+    from_id = 0 if from_context is None else from_context._id
+    to_id = None if to_context is None else to_context._id
+    end_id = srv.trace.transition_count if to_id is None else to_id
+
+    shards = split_shards(from_id, end_id, jobs)
+
+    # workers load the index instead of each searching and saving it
+    index = open_index(srv, binary_path, process_filter(pid, process_name))
+    if index is not None:
+        index.update(from_id, end_id)
+
+    max_pending = jobs * PENDING_SHARDS_PER_JOB
+
+    with open_output(output) as out, multiprocessing.Pool(
+        jobs,
+        initializer=_init_worker,
+        initargs=(
+            host,
+            port,
+            binary_path,
+            to_id,
+            pretty_mode,
+            pairing,
+            cache.cache_root,
+            summary,
+            patterns,
+            pid,
+            process_name,
+        ),
+    ) as pool:
+        call_summary = CallSummary()
+
+        def write(result):
+            if summary:
+                call_summary.merge(result)
+            else:
+                out.write(result)
+
+        if not summary:
+            write_header(get_print_func(pretty_mode), out)
+        pending = collections.deque()
+        for index, (shard_from, shard_to) in enumerate(shards):
+            pending.append(
+                pool.apply_async(
+                    _ltrace_shard, (shard_from, shard_to, index == 0)
+                )
+            )
+            if len(pending) >= max_pending:
+                write(pending.popleft().get())
+
+        while pending:
+            write(pending.popleft().get())
+
+        if summary:
+            call_summary.print_table(out)
@@ -1,54 +1,173 @@
 """Sugar to display call info
+
+Everything is resolved lazily, on first access, and only once per call.
 """
 
-from .prototypes import demangle
+from .prototypes import demangle, prototype
 from .reven import reven_helper as rvnh
-from .prototype_formatter import format_value, get_argument_values
+from .reven.ossi_cache import location_cache, location_key
+from .prototype_formatter import (
+    get_argument_values,
+    get_formatter,
+    get_proto_formatters,
+)
+
+
+# marks an attribute not resolved yet, as None is a valid resolved value
+_UNRESOLVED = object()
+
+
+def dummy_proto(symbol_name):
+    return prototype.Prototype(
+        name=symbol_name,
+        return_type=prototype.PrototypeType(
+            name="?", real_type="?", format="guess", size=None
+        ),
+    )
+
+
+class CallRecord(object):
+    """A call leaving the traced binary at transition point.
+
+    @param info: prototypes.call_info.CallInfo used to resolve the prototype
+    @param returns: reven.return_points.ReturnPoints used to resolve the
+        ret point, if None the memory history is queried
+    """
+
+    __slots__ = (
+        "_point",
+        "_info",
+        "_returns",
+        "_location",
+        "_cr3",
+        "_symbol",
+        "_tr",
+        "_proto",
+        "_args",
+        "_ret",
+    )
+
+    def __init__(self, point, info=None, returns=None):
+        self._point = point
+        self._info = info
+        self._returns = returns
+        self._location = _UNRESOLVED
+        self._cr3 = None
+        self._symbol = _UNRESOLVED
+        self._tr = None
+        self._proto = None
+        self._args = None
+        self._ret = None
 
+    @property
+    def point(self):
+        return self._point
 
-class PrettyProto(object):
-    def __init__(self, tr, proto):
-        self._proto = proto
-        self._tr = tr
-        self._ret = PrettyRet(proto.return_type, tr)
+    @property
+    def location(self):
+        if self._location is _UNRESOLVED:
+            try:
+                context = self._point.context_after()
+                key = location_key(context)
+                self._cr3 = key[1]
+                self._location = location_cache.location(context, key)
+            except RuntimeError:
+                self._location = None
+        return self._location
+
+    @property
+    def cr3(self):
+        """cr3 of the call, None if it cannot be read"""
+        self.location
+        return self._cr3
+
+    @property
+    def symbol(self):
+        if self._symbol is _UNRESOLVED:
+            self._symbol = rvnh.symbol_after(self._point, self.location)
+        return self._symbol
 
     @property
     def tr(self):
-        return PrettyTr(self._tr)
+        if self._tr is None:
+            self._tr = PrettyTr(self._point, self.location)
+        return self._tr
+
+    @property
+    def proto(self):
+        if self._proto is None:
+            symbol = self.symbol
+            if symbol is None:
+                self._proto = dummy_proto("<unknown>")
+            else:
+                proto = self._info.resolve_proto(symbol)
+                self._proto = proto or dummy_proto(symbol.name)
+        return self._proto
 
     @property
     def func(self):
-        return self._proto.name
+        return self.proto.name
 
     @property
     def ret(self):
+        if self._ret is None:
+            ret_formatter, _ = get_proto_formatters(self.proto)
+            self._ret = PrettyRet(
+                self.proto.return_type,
+                self._point,
+                self._returns,
+                ret_formatter,
+                self.cr3,
+            )
         return self._ret
 
+    @property
+    def depth(self):
+        if self._returns is None:
+            return None
+        return self._returns.depth(self._point)
+
     @property
     def params(self):
         return [
             PrettyArg(a, i, value=None, tr=None)
-            for i, a in enumerate(self._proto.args)
+            for i, a in enumerate(self.proto.args)
             if not a.is_void()
         ]
 
     @property
     def args(self):
-        args = get_argument_values(self._tr, self._proto)
-        return [
-            PrettyArg(a, i, v, self._tr)
-            for i, (a, v) in enumerate(args)
-            if not a.is_void()
-        ]
+        if self._args is None:
+            callconv = binary_path = None
+            if self.symbol is not None:
+                callconv, _ = demangle.msvc_demangle(self.symbol.name)
+            if self.location is not None and self.location.binary:
+                binary_path = self.location.binary.path
+            args = get_argument_values(
+                self._point, self.proto, callconv, binary_path
+            )
+            _, formatters = get_proto_formatters(self.proto)
+            self._args = [
+                PrettyArg(a, i, v, self._point, f, self.cr3)
+                for i, ((a, v), f) in enumerate(zip(args, formatters))
+                if not a.is_void()
+            ]
+        return self._args
 
     def __str__(self):
-        return str(self._proto.name)
+        return str(self.proto.name)
 
 
 class PrettyTr(object):
-    def __init__(self, tr):
+    __slots__ = ("_tr", "_ossi_after")
+
+    def __init__(self, tr, location=_UNRESOLVED):
         self._tr = tr
-        self._ossi_after = tr.context_after().ossi.location()
+        self._ossi_after = (
+            tr.context_after().ossi.location()
+            if location is _UNRESOLVED
+            else location
+        )
 
     @property
     def id(self):
@@ -76,6 +195,8 @@ class PrettyTr(object):
 
 
 class PrettyType(object):
+    __slots__ = ("_type",)
+
     def __init__(self, type):
         self._type = type
 
@@ -100,15 +221,52 @@ class PrettyType(object):
 
 
 class PrettyRet(object):
-    def __init__(self, type, tr):
+    __slots__ = (
+        "_type",
+        "_call",
+        "_returns",
+        "_formatter",
+        "_cr3",
+        "_tr",
+        "_value",
+        "_formatted",
+    )
+
+    def __init__(self, type, tr, returns=None, formatter=None, cr3=None):
         self._type = type
-        self._tr = rvnh.get_ret_point(tr)
+        self._call = tr
+        self._returns = returns
+        self._formatter = formatter or get_formatter(type.format)
+        self._cr3 = cr3
+        self._tr = _UNRESOLVED
+        self._value = None
+        self._formatted = _UNRESOLVED
+
+    def _resolve(self):
+        if self._tr is not _UNRESOLVED:
+            return
+        self._tr = (
+            rvnh.get_ret_point(self._call)
+            if self._returns is None
+            else self._returns.ret_point(self._call)
+        )
         self._value = (
             None if self._tr is None else rvnh.get_ret_raw_value(self._tr)
         )
 
+    @property
+    def point(self):
+        self._resolve()
+        return self._tr
+
+    @property
+    def raw(self):
+        self._resolve()
+        return self._value
+
     @property
     def tr(self):
+        self._resolve()
         if self._tr is None:
             return "#unknown"
 
@@ -120,7 +278,12 @@ class PrettyRet(object):
 
     @property
     def value(self):
-        return format_value(self._value, self._type.format, self._tr)
+        if self._formatted is _UNRESOLVED:
+            self._resolve()
+            self._formatted = self._formatter(
+                self._value, self._tr, self._cr3
+            )
+        return self._formatted
 
     def __str__(self):
         if self.value is None:
@@ -129,11 +292,24 @@ class PrettyRet(object):
 
 
 class PrettyArg(object):
-    def __init__(self, arg, index, value, tr):
+    __slots__ = (
+        "_arg",
+        "_value",
+        "_index",
+        "_tr",
+        "_formatter",
+        "_cr3",
+        "_formatted",
+    )
+
+    def __init__(self, arg, index, value, tr, formatter=None, cr3=None):
         self._arg = arg
         self._value = value
         self._index = index
         self._tr = tr
+        self._formatter = formatter or get_formatter(arg.type.format)
+        self._cr3 = cr3
+        self._formatted = _UNRESOLVED
 
     @property
     def name(self):
@@ -141,11 +317,20 @@ class PrettyArg(object):
             return "arg{}".format(self._index + 1)
         return self._arg.name
 
+    @property
+    def raw(self):
+        return self._value
+
     @property
     def value(self):
-        if self._arg.is_void():
-            return ""
-        return format_value(self._value, self._arg.type.format, self._tr)
+        if self._formatted is _UNRESOLVED:
+            if self._arg.is_void():
+                self._formatted = ""
+            else:
+                self._formatted = self._formatter(
+                    self._value, self._tr, self._cr3
+                )
+        return self._formatted
 
     @property
     def type(self):
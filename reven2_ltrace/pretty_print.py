@@ -1,12 +1,35 @@
 """Output modes to display call info
 """
 
+import csv
 import inspect
+import json
 import sys
 
-from .pretty import PrettyProto, PrettyTr
-from .prototypes import prototype
-from .reven import reven_helper as rvnh
+import reven2
+
+from .pretty import CallRecord
+from .prototype_formatter import as_uint_value
+
+
+# number of calls whose prototypes are resolved at once
+PREFETCH_WINDOW = 256
+
+# print modes not displaying prototypes
+PROTOTYPE_FREE_MODES = ("tr", "instr", "ossi")
+
+
+# columns of the csv print mode
+CSV_COLUMNS = (
+    "call_id",
+    "ret_id",
+    "binary",
+    "symbol",
+    "args",
+    "ret_type",
+    "ret_raw",
+    "ret_value",
+)
 
 
 def get_print_func(pretty_mode):
@@ -28,104 +51,196 @@ def list_print_modes():
     ]
 
 
-def dummy_proto(tr, symbol_name):
-    proto = prototype.Prototype()
-    proto.name = symbol_name
-    proto.return_type = prototype.PrototypeType(
-        name="?", real_type="?", format="guess", size=None
-    )
-    return proto
-
-
-def get_pretty_proto(tr, info):
-    symbol = rvnh.symbol_after(tr)
-    if symbol is None:
-        proto = dummy_proto(tr, "<unknown>")
-    else:
-        proto = info.resolve_proto(symbol) or dummy_proto(tr, symbol.name)
-    return PrettyProto(tr, proto)
-
-
-def print_default(tr, info):
+def write_header(print_info, file=None):
+    """Print the header of the print_info mode, if it has one"""
+    header = getattr(print_info, "header", None)
+    if header is not None:
+        print(header, file=file)
+
+
+def get_pretty_proto(tr, info, returns=None):
+    return CallRecord(tr, info, returns)
+
+
+def get_pretty_protos(
+    trs, info, returns=None, pretty_mode=None, call_filter=None
+):
+    """Generate the CallRecord of each call transition of trs.
+
+    Unless pretty_mode does not display prototypes, the prototypes of
+    PREFETCH_WINDOW calls are resolved at once. If given, calls not
+    selected by the call_filter.CallFilter call_filter are skipped before
+    anything but their symbol is resolved.
+    """
+    prefetch = pretty_mode not in PROTOTYPE_FREE_MODES
+    window = []
+    for tr in trs:
+        # ignore pagefaults
+        if tr.type != reven2.trace.TransitionType.Instruction:
+            continue
+        call = CallRecord(tr, info, returns)
+        if call_filter is not None and not call_filter.selects(call):
+            continue
+        window.append(call)
+        if len(window) >= PREFETCH_WINDOW or not prefetch:
+            if prefetch:
+                info.prefetch([call.symbol for call in window])
+            yield from window
+            window = []
+
+    if prefetch and window:
+        info.prefetch([call.symbol for call in window])
+    yield from window
+
+
+def print_default(call, file=None):
     """Print oneline by default"""
-    print_oneline(tr, info)
+    print_oneline(call, file)
 
 
-def print_tr(tr, info=None):
+def print_tr(call, file=None):
     """Print transition id"""
-    print("#{}".format(tr.id))
+    print("#{}".format(call.point.id), file=file)
 
 
-def print_instr(tr, info=None):
+def print_instr(call, file=None):
     """Print transition id and instruction"""
-    print("#{id} {instr}".format(id=tr.id, instr=str(tr.instruction)))
+    tr = call.point
+    print(
+        "#{id} {instr}".format(id=tr.id, instr=str(tr.instruction)), file=file
+    )
 
 
-def print_ossi(tr, info=None):
+def print_ossi(call, file=None):
     """Print transition id and called binary and symbol"""
-    print("{tr} {tr.to_bin}!{tr.to_sym}".format(tr=PrettyTr(tr)))
+    print("{tr} {tr.to_bin}!{tr.to_sym}".format(tr=call.tr), file=file)
 
 
-def print_proto(tr, info):
+def print_proto(call, file=None):
     """Print prototype without values"""
     fmt = "{tr} {ret.type} {func}({params})"
     param_fmt = "{param.type} {param.name}"
 
-    proto = get_pretty_proto(tr, info)
-    params = ", ".join([param_fmt.format(param=p) for p in proto.params])
+    params = ", ".join([param_fmt.format(param=p) for p in call.params])
     print(
-        fmt.format(
-            tr=PrettyTr(tr), ret=proto.ret, func=proto.func, params=params
-        )
+        fmt.format(tr=call.tr, ret=call.ret, func=call.func, params=params),
+        file=file,
     )
 
 
-def print_ltrace(tr, info):
+def print_ltrace(call, file=None):
     """Print prototype and values in original ltrace-like style"""
     fmt = "{tr} {func}({values}) = {ret}"
 
-    cs = get_pretty_proto(tr, info)
-    args_value = ", ".join([arg.value for arg in cs.args])
-    print(fmt.format(tr=cs.tr, func=cs.func, values=args_value, ret=cs.ret))
+    args_value = ", ".join([arg.value for arg in call.args])
+    print(
+        fmt.format(
+            tr=call.tr, func=call.func, values=args_value, ret=call.ret
+        ),
+        file=file,
+    )
 
 
-def print_oneline(tr, info):
+def print_oneline(call, file=None):
     """Print extra information oneline"""
     fmt = "{tr} {ret.type} {bin}!{func}({args}) = {ret.value} at {ret.tr}"
     arg_fmt = "{arg.type} {arg.name}={arg.value}"
 
-    cs = get_pretty_proto(tr, info)
-    args = ", ".join([arg_fmt.format(arg=arg) for arg in cs.args])
+    args = ", ".join([arg_fmt.format(arg=arg) for arg in call.args])
     print(
         fmt.format(
-            tr=cs.tr, ret=cs.ret, bin=cs.tr.to_bin, func=cs.func, args=args
-        )
+            tr=call.tr,
+            ret=call.ret,
+            bin=call.tr.to_bin,
+            func=call.func,
+            args=args,
+        ),
+        file=file,
     )
 
 
-def print_full_info(tr, info):
+def print_full_info(call, file=None):
     """Print full information in multiple lines"""
     fmt = "{tr} {bin}!{func}({args}) = {ret.value} {ret_type_info} at {ret.tr}"
     arg_fmt = "{arg.name}={arg.value} {type_info}"
     type_info_fmt = "[{type.name}][{type.real}][{type.format}][{type.size}]"
 
-    cs = get_pretty_proto(tr, info)
-
     args = []
-    for arg in cs.args:
+    for arg in call.args:
         arg_type = type_info_fmt.format(type=arg.type)
         args.append(arg_fmt.format(arg=arg, type_info=arg_type))
     args = ",\n\t".join(args)
 
-    ret_type = type_info_fmt.format(type=cs.ret.type)
+    ret_type = type_info_fmt.format(type=call.ret.type)
 
     print(
         fmt.format(
-            tr=cs.tr,
-            bin=cs.tr.to_bin,
-            func=cs.func,
+            tr=call.tr,
+            bin=call.tr.to_bin,
+            func=call.func,
             args=args,
-            ret=cs.ret,
+            ret=call.ret,
             ret_type_info=ret_type,
+        ),
+        file=file,
+    )
+
+
+def _raw_int(raw_value):
+    return None if raw_value is None else as_uint_value(raw_value)
+
+
+def call_values(call):
+    """Return the dict of the values of call, as printed by jsonl"""
+    location = call.location
+    ret_point = call.ret.point
+    return {
+        "call_id": call.point.id,
+        "ret_id": None if ret_point is None else ret_point.id,
+        "binary": (
+            location.binary.name
+            if location is not None and location.binary
+            else None
+        ),
+        "symbol": call.func,
+        "args": [
+            {
+                "name": arg.name,
+                "type": arg.type.name,
+                "raw": _raw_int(arg.raw),
+                "value": arg.value,
+            }
+            for arg in call.args
+        ],
+        "ret": {
+            "type": call.ret.type.name,
+            "raw": _raw_int(call.ret.raw),
+            "value": call.ret.value,
+        },
+    }
+
+
+def print_jsonl(call, file=None):
+    """Print one JSON object per call, raw values are unsigned integers"""
+    print(json.dumps(call_values(call), default=str), file=file)
+
+
+def print_csv(call, file=None):
+    """Print one CSV row per call, args are a JSON list as in jsonl"""
+    values = call_values(call)
+    ret = values["ret"]
+    csv.writer(file or sys.stdout, lineterminator="\n").writerow(
+        (
+            values["call_id"],
+            values["ret_id"],
+            values["binary"],
+            values["symbol"],
+            json.dumps(values["args"], default=str),
+            ret["type"],
+            ret["raw"],
+            ret["value"],
         )
     )
+
+
+print_csv.header = ",".join(CSV_COLUMNS)
@@ -1,8 +1,11 @@
 """Argument formatting
 """
 
-from reven2.types import FixedWidthInteger, Signedness, Endianness
+import collections
+import struct
+
 from .reven import reven_helper as rvnh
+from .reven.arg_plans import get_plan, select_convention
 
 ltraceconf_formats = {
     "addr": ("%#x", 4),
@@ -40,107 +43,181 @@ typesconf_formats = {
 }
 
 
+# unpackers of little endian integers, by size
+_signed_unpackers = {
+    size: struct.Struct("<" + code).unpack
+    for size, code in ((1, "b"), (2, "h"), (4, "i"), (8, "q"))
+}
+_unsigned_unpackers = {
+    size: struct.Struct("<" + code).unpack
+    for size, code in ((1, "B"), (2, "H"), (4, "I"), (8, "Q"))
+}
+
+# number of prototypes whose formatters are kept
+MAX_FORMATTERS = 4096
+
+
 def as_int_value(raw_value):
-    return FixedWidthInteger(len(raw_value), Signedness.Signed,
-                             Endianness.Little).parse(raw_value)
+    unpack = _signed_unpackers.get(len(raw_value))
+    if unpack is None:
+        return int.from_bytes(raw_value, "little", signed=True)
+    return unpack(raw_value)[0]
 
 
 def as_uint_value(raw_value):
-    return FixedWidthInteger(len(raw_value), Signedness.Unsigned,
-                             Endianness.Little).parse(raw_value)
+    unpack = _unsigned_unpackers.get(len(raw_value))
+    if unpack is None:
+        return int.from_bytes(raw_value, "little", signed=False)
+    return unpack(raw_value)[0]
 
 
-def format_value(raw_value, fmt, point):
-    if fmt is None:
-        return "void"
+def _format_void(raw_value, point, cr3=None):
+    return "void"
 
-    if fmt == "void":
-        return "void"
 
+def _format_bool(raw_value, point, cr3=None):
     if raw_value is None:
         return "?"
+    return "true" if as_int_value(raw_value) else "false"
 
-    if fmt == "bool":
-        return "true" if as_int_value(raw_value) else "false"
 
-    if fmt == "tstring":
-        fmt = typesconf_formats["tstring"]
-
-    if fmt == "wstring":
+def _string_formatter(get_string):
+    def format_string(raw_value, point, cr3=None):
+        if raw_value is None:
+            return "?"
         value = as_uint_value(raw_value)
         if value == 0:
             return "nullstr"
-        string_value = rvnh.get_wstring_arg(point, value)
+        string_value = get_string(point, value, cr3)
         if string_value is None:
             return "str %#x" % (value)
         return "%s %#x" % (ascii(string_value), value)
 
-    if fmt == "string" or fmt == "cstring":
-        value = as_uint_value(raw_value)
-        if value == 0:
-            return "nullstr"
-        string_value = rvnh.get_string_arg(point, value)
-        if string_value is None:
-            return "str %#x" % (value)
-        return "%s %#x" % (ascii(string_value), value)
+    return format_string
 
-    if fmt == "char":
-        value = as_int_value(raw_value)
-        return ascii("%c" % (value & 0xFF))
 
-    if fmt == "addr":
-        value = as_uint_value(raw_value)
-        return "%#x" % value
+_format_wstring = _string_formatter(rvnh.get_wstring_arg)
+_format_string = _string_formatter(rvnh.get_string_arg)
 
-    if fmt == "unsigned":
-        return str(as_uint_value(raw_value))
 
-    if fmt == "signed":
-        return str(as_int_value(raw_value))
+def _format_char(raw_value, point, cr3=None):
+    if raw_value is None:
+        return "?"
+    return ascii("%c" % (as_int_value(raw_value) & 0xFF))
 
-    if fmt in ltraceconf_formats:
-        value = as_int_value(raw_value)
-        return ltraceconf_formats[fmt][0] % value
 
-    if fmt in typesconf_formats:
-        value = as_int_value(raw_value)
-        return typesconf_formats[fmt] % value
+def _format_addr(raw_value, point, cr3=None):
+    if raw_value is None:
+        return "?"
+    return "%#x" % as_uint_value(raw_value)
 
-    if fmt == "guess":
-        threshold = 199999
-        value = as_int_value(raw_value)
-        if value < -threshold or value > threshold:
-            value = as_uint_value(raw_value)
-            return hex(value)
-        else:
-            return str(value)
 
+def _format_unsigned(raw_value, point, cr3=None):
+    if raw_value is None:
+        return "?"
+    return str(as_uint_value(raw_value))
+
+
+def _format_signed(raw_value, point, cr3=None):
+    if raw_value is None:
+        return "?"
+    return str(as_int_value(raw_value))
+
+
+def _format_guess(raw_value, point, cr3=None):
+    if raw_value is None:
+        return "?"
+    threshold = 199999
     value = as_int_value(raw_value)
-    return fmt % value
+    if value < -threshold or value > threshold:
+        return hex(as_uint_value(raw_value))
+    return str(value)
+
+
+def _printf_formatter(fmt):
+    def format_printf(raw_value, point, cr3=None):
+        if raw_value is None:
+            return "?"
+        return fmt % as_int_value(raw_value)
+
+    return format_printf
+
+
+def _compile_format(fmt):
+    if fmt is None or fmt == "void":
+        return _format_void
+    if fmt == "bool":
+        return _format_bool
+    if fmt == "tstring":
+        fmt = typesconf_formats["tstring"]
+    if fmt == "wstring":
+        return _format_wstring
+    if fmt == "string" or fmt == "cstring":
+        return _format_string
+    if fmt == "char":
+        return _format_char
+    if fmt == "addr":
+        return _format_addr
+    if fmt == "unsigned":
+        return _format_unsigned
+    if fmt == "signed":
+        return _format_signed
+    if fmt in ltraceconf_formats:
+        return _printf_formatter(ltraceconf_formats[fmt][0])
+    if fmt in typesconf_formats:
+        return _printf_formatter(typesconf_formats[fmt])
+    if fmt == "guess":
+        return _format_guess
+    return _printf_formatter(fmt)
+
+
+_format_formatters = {}
+
+
+def get_formatter(fmt):
+    """Return the function formatting (raw value, point, cr3) with fmt.
+
+    cr3 is the one of the context before point, read if None.
+    """
+    formatter = _format_formatters.get(fmt)
+    if formatter is None:
+        formatter = _format_formatters[fmt] = _compile_format(fmt)
+    return formatter
+
+
+def format_value(raw_value, fmt, point, cr3=None):
+    return get_formatter(fmt)(raw_value, point, cr3)
+
 
+_proto_formatters = collections.OrderedDict()
 
-def get_argument_values(point, proto):
-    is_64bit = point.context_before().is64b()
 
-    offset = 4
-    iargs = rvnh.ms_x64_args(point.context_before(), raw=True)
+def get_proto_formatters(proto):
+    """Return (return formatter, (argument formatters)) of proto.
 
-    args = []
+    Formatters are compiled once per prototype.
+    """
+    formatters = _proto_formatters.get(proto)
+    if formatters is None:
+        formatters = (
+            get_formatter(proto.return_type.format),
+            tuple(get_formatter(arg.type.format) for arg in proto.args),
+        )
+        _proto_formatters[proto] = formatters
+        if len(_proto_formatters) > MAX_FORMATTERS:
+            _proto_formatters.popitem(last=False)
+    return formatters
 
-    for proto_arg in proto.args:
-        arg_value = None
-        if not proto_arg.is_void():
-            if is_64bit:
-                arg_value = next(iargs)
-            else:
-                type_size = proto_arg.type.size
-                if type_size is None:
-                    type_size = 4
-                arg_value = rvnh.get_int_arg(
-                    point, offset, type_size, raw=True
-                )
-                offset += type_size
 
-        args.append((proto_arg, arg_value))
+def get_argument_values(point, proto, callconv=None, binary_path=None):
+    """Return [(proto arg, raw value)] of the call at point.
 
-    return args
+    @param callconv: str of the msvc calling convention, used when proto
+        does not have one
+    @param binary_path: str of the path of the called binary
+    """
+    convention = select_convention(
+        point.context_before(), proto.callconv or callconv, binary_path
+    )
+    values = get_plan(proto, convention).read(point)
+    return list(zip(proto.args, values))
@@ -0,0 +1,124 @@
+"""Build the prototype database of the resource files
+
+Every function of msdn.xml is parsed with the REVEN server, so that
+ltrace does not parse them at run time.
+
+Usage: python -m reven2_ltrace.prototypes.build_db --host HOST --port PORT
+
+The database is written in the cache directory, where ltrace reads it.
+"""
+
+import argparse
+import os
+from sys import stderr
+
+import reven2
+
+from ..resources import (
+    msdn_xml,
+    msdn_typedefs_conf,
+    ltrace_conf,
+    ltrace_extra_conf,
+)
+from .call_info import clang_parse
+from .ltraceconf.ltraceconf import LTraceConf
+from .msdnxml.clangparser import ProtoStrParser
+from .msdnxml.msdn_xml_file import MsdnXmlFile
+from .. import cache
+from .prototype_db import (
+    LTRACE,
+    LTRACE_EXTRA,
+    MSDN,
+    default_db_path,
+    resources_key,
+    write_db,
+)
+
+
+def _msdn_entries(srv):
+    proto_parser = ProtoStrParser(srv, msdn_typedefs_conf)
+    for name, proto_str in MsdnXmlFile(msdn_xml).functions():
+        proto = None
+        if proto_str is not None:
+            try:
+                proto = clang_parse(proto_parser, proto_str, None)
+            except Exception as e:
+                print(
+                    "WAR: Cannot parse `{}`: {}".format(proto_str, e),
+                    file=stderr,
+                )
+        yield (MSDN, name, proto)
+
+
+def _ltrace_entries(source, conf_path):
+    conf = LTraceConf(conf_path)
+    for name in conf.functions:
+        yield (source, name, conf.get_proto(name))
+
+
+def build_db(srv, db_path):
+    """Resolve the prototypes of all the resource files in db_path"""
+    key = resources_key(
+        msdn_xml, msdn_typedefs_conf, ltrace_conf, ltrace_extra_conf
+    )
+
+    def entries():
+        yield from _ltrace_entries(LTRACE, ltrace_conf)
+        yield from _ltrace_entries(LTRACE_EXTRA, ltrace_extra_conf)
+        yield from _msdn_entries(srv)
+
+    tmp_path = "{}.{}.tmp".format(db_path, os.getpid())
+    try:
+        write_db(tmp_path, key, entries())
+        os.replace(tmp_path, db_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the prototype database used by reven2-ltrace"
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="localhost",
+        help='reven host, as a string (default: "localhost")',
+    )
+    parser.add_argument(
+        "-p",
+        "--port",
+        type=int,
+        default="13370",
+        help="reven port, as an int (default: 13370)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=cache.cache_root,
+        help="directory of the persistent caches (default: {})".format(
+            cache.cache_root
+        ),
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        help="path of the database (default: in the cache directory)",
+    )
+    args = parser.parse_args()
+
+    cache.cache_root = args.cache_dir
+    db_path = args.output or default_db_path()
+    if db_path is None:
+        parser.error(
+            "cannot create the cache directory {}".format(args.cache_dir)
+        )
+
+    srv = reven2.RevenServer(args.host, args.port)
+    build_db(srv, db_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,269 @@
 """Retrieve prototype information from resources
 """
 
-import functools
+import collections
+from sys import stderr
 
 from .demangle import msvc_demangle
 
 from .ltraceconf.ltraceconf import LTraceConf
 from .msdnxml.msdn_xml_file import MsdnXmlFile
 from .msdnxml.clangparser import ProtoStrParser
+from .proto_cache import open_proto_cache
+from .prototype_db import (
+    LTRACE,
+    LTRACE_EXTRA,
+    MSDN,
+    PrototypeDB,
+    resources_key,
+)
+
+
+# number of prototypes kept in memory
+MAX_PROTOS = 2048
+
+_UNOPENED = object()
 
 
 def clang_parse(proto_parser, proto_str, callconv):
+    learned = proto_parser.uses_unknown_types(proto_str)
     clang = proto_parser.get_proto(proto_str, callconv)
     unknown_types = clang.diag.unknown_types()
     if not unknown_types:
+        if learned:
+            proto_parser.reparses_avoided += 1
         return clang.proto
 
+    proto_parser.learn_unknown_types(unknown_types)
+    proto_parser.reparses += 1
     clang = proto_parser.clang()
-    for t in unknown_types:
-        clang.add_typedef(t, "addr")
     clang.parse_proto(proto_str, callconv)
 
     return clang.proto
 
 
+def clang_parse_many(proto_parser, proto_strs):
+    """Parse {name: proto_str} in a single translation unit.
+
+    Return {name: proto} for the prototypes found in the translation unit,
+    the others are to be parsed one by one.
+    """
+    clang = proto_parser.clang()
+    protos = clang.parse_protos(proto_strs.values())
+    unknown_types = clang.diag.unknown_types()
+    if unknown_types:
+        proto_parser.learn_unknown_types(unknown_types)
+        proto_parser.reparses += 1
+        clang = proto_parser.clang()
+        protos = clang.parse_protos(proto_strs.values())
+
+    parsed = {}
+    for name, proto_str in proto_strs.items():
+        proto = protos.get(name)
+        if proto is not None:
+            parsed[name] = proto.replace(full_proto=proto_str)
+    return parsed
+
+
 class CallInfo(object):
+    """Resolve prototypes of symbols
+
+    Resource files are only loaded on the first lookup.
+
+    @param prototypes_db: path of the prototype_db.PrototypeDB of the
+        resource files, if up to date, it is used instead of the resource
+        files
+    """
+
     def __init__(
-        self, srv, msdn_xml, msdn_typedefs_conf, ltrace_conf, ltrace_extra_conf
+        self,
+        srv,
+        msdn_xml,
+        msdn_typedefs_conf,
+        ltrace_conf,
+        ltrace_extra_conf,
+        prototypes_db=None,
     ):
-        self.msdn_xml = MsdnXmlFile(msdn_xml)
         self.proto_parser = ProtoStrParser(srv, msdn_typedefs_conf)
-        self.ltrace_info = LTraceConf(ltrace_conf)
-        self.ltrace_extra_info = LTraceConf(ltrace_extra_conf)
+        self.msdn_xml = MsdnXmlFile(msdn_xml)
+        self._resources = (
+            msdn_xml,
+            msdn_typedefs_conf,
+            ltrace_conf,
+            ltrace_extra_conf,
+        )
+        self._prototypes_db = prototypes_db
+        self._resources_key = None
+        self._db = None
+        self._ltrace_info = None
+        self._ltrace_extra_info = None
+        # (name, demangled name) -> proto
+        self._protos = collections.OrderedDict()
+        self._proto_cache = _UNOPENED
+        self.memory_hits = 0
+        self.resolved = 0
+        # msdn function name -> proto parsed by prefetch, None if it is to
+        # be parsed alone
+        self._prefetched = {}
+
+    @property
+    def resources_key(self):
+        """prototype_db.resources_key of the resource files, hashed once"""
+        if self._resources_key is None:
+            self._resources_key = resources_key(*self._resources)
+        return self._resources_key
+
+    @property
+    def db(self):
+        """The up to date prototype db, or None"""
+        if self._prototypes_db is not None:
+            db = PrototypeDB(self._prototypes_db, self.resources_key)
+            self._db = db if db.is_valid() else None
+            self._prototypes_db = None
+        return self._db
+
+    def _load_ltrace_confs(self):
+        # ltrace-extra.conf may use types of ltrace.conf
+        _, _, ltrace_conf, ltrace_extra_conf = self._resources
+        self._ltrace_info = LTraceConf(ltrace_conf)
+        self._ltrace_extra_info = LTraceConf(ltrace_extra_conf)
+
+    @property
+    def ltrace_info(self):
+        if self._ltrace_info is None:
+            self._load_ltrace_confs()
+        return self._ltrace_info
+
+    @property
+    def ltrace_extra_info(self):
+        if self._ltrace_extra_info is None:
+            self._load_ltrace_confs()
+        return self._ltrace_extra_info
+
+    def _ltrace_proto(self, source, name):
+        if self.db is not None:
+            return self.db.lookup(source, name)[1]
+        if source == LTRACE_EXTRA:
+            return self.ltrace_extra_info.get_proto(name)
+        return self.ltrace_info.get_proto(name)
+
+    def _msdn_proto(self, func_name, callconv):
+        if self.db is not None:
+            return self.db.lookup(MSDN, func_name, callconv)[1]
+
+        proto = self._prefetched.get(func_name)
+        if proto is not None:
+            return proto.replace(callconv=callconv)
+
+        proto_str = self.msdn_xml.function_proto_str(func_name)
+        if proto_str is None:
+            return None
+        return clang_parse(self.proto_parser, proto_str, callconv)
+
+    def prefetch(self, symbols):
+        """Parse the msdn prototypes of symbols in a single server request.
+
+        Prototypes are only parsed at run time without an up to date db.
+        """
+        if self.db is not None:
+            return
+
+        proto_strs = {}
+        for symbol in symbols:
+            if symbol is None or symbol.demangled_name is not None:
+                continue
+            key = (symbol.name, symbol.demangled_name)
+            if self._cached_proto(key, count=False)[0]:
+                continue
+            if self._ltrace_proto(LTRACE_EXTRA, symbol.name) is not None:
+                continue
+            if self._ltrace_proto(LTRACE, symbol.name) is not None:
+                continue
+            _, func_name = msvc_demangle(symbol.name)
+            if func_name in self._prefetched or func_name in proto_strs:
+                continue
+            proto_str = self.msdn_xml.function_proto_str(func_name)
+            if proto_str is not None:
+                proto_strs[func_name] = proto_str
+
+        if len(proto_strs) < 2:
+            return
+        try:
+            parsed = clang_parse_many(self.proto_parser, proto_strs)
+        except Exception as e:
+            print(
+                "WAR: Cannot parse {} prototypes at once: {}".format(
+                    len(proto_strs), e
+                ),
+                file=stderr,
+            )
+            parsed = {}
+        for func_name in proto_strs:
+            self._prefetched[func_name] = parsed.get(func_name)
+
+    @property
+    def proto_cache(self):
+        """The persistent proto_cache.ProtoCache, None if caching is off"""
+        if self._proto_cache is _UNOPENED:
+            self._proto_cache = open_proto_cache(self.resources_key)
+        return self._proto_cache
+
+    @property
+    def cache_hits(self):
+        """Number of prototypes found in the persistent cache"""
+        if self._proto_cache is _UNOPENED or self._proto_cache is None:
+            return 0
+        return self._proto_cache.hits
+
+    def _cached_proto(self, key, count=True):
+        """Return (found, proto) from the memory or persistent cache.
+
+        Hits are counted in the statistics only if count is True.
+        """
+        try:
+            proto = self._protos[key]
+        except KeyError:
+            pass
+        else:
+            if count:
+                self.memory_hits += 1
+            self._protos.move_to_end(key)
+            return (True, proto)
+
+        if self.proto_cache is None:
+            return (False, None)
+        found, proto = self.proto_cache.get(*key, count=count)
+        if found:
+            self._remember(key, proto)
+        return (found, proto)
+
+    def _remember(self, key, proto):
+        self._protos[key] = proto
+        if len(self._protos) > MAX_PROTOS:
+            self._protos.popitem(last=False)
 
-    @functools.lru_cache(maxsize=2048)
     def resolve_proto(self, symbol):
+        """Return the prototype of symbol, or None if unknown"""
+        key = (symbol.name, symbol.demangled_name)
+        found, proto = self._cached_proto(key)
+        if found:
+            return proto
+
+        proto = self._resolve_proto(symbol)
+        self.resolved += 1
+        self._remember(key, proto)
+        if self.proto_cache is not None:
+            self.proto_cache.put(symbol.name, symbol.demangled_name, proto)
+        return proto
+
+    def flush(self):
+        """Save the prototypes resolved so far in the persistent cache"""
+        # nothing to save if no prototype was resolved
+        if self._proto_cache is _UNOPENED or self._proto_cache is None:
+            return
+        self._proto_cache.flush()
+
+    def _resolve_proto(self, symbol):
         # demangled
         demangled_name = symbol.demangled_name
         if demangled_name is not None:  # assume demangled proto
@@ -45,31 +274,29 @@ class CallInfo(object):
 
         symbol_name = symbol.name
         # ltrace-extra.conf
-        maybe_proto = self.ltrace_extra_info.get_proto(symbol_name)
+        maybe_proto = self._ltrace_proto(LTRACE_EXTRA, symbol_name)
         if maybe_proto is not None:
             return maybe_proto
 
         # ltrace.conf
-        maybe_proto = self.ltrace_info.get_proto(symbol_name)
+        maybe_proto = self._ltrace_proto(LTRACE, symbol_name)
         if maybe_proto is not None:
             return maybe_proto
 
         callconv, func_name = msvc_demangle(symbol_name)
 
         # msdn.xml
-        proto_str = self.msdn_xml.function_proto_str(func_name)
-        if proto_str is not None:
-            maybe_proto = clang_parse(self.proto_parser, proto_str, callconv)
-            if maybe_proto is not None:
-                return maybe_proto
+        maybe_proto = self._msdn_proto(func_name, callconv)
+        if maybe_proto is not None:
+            return maybe_proto
 
         # ltrace-extra.conf - demangled
-        maybe_proto = self.ltrace_extra_info.get_proto(func_name)
+        maybe_proto = self._ltrace_proto(LTRACE_EXTRA, func_name)
         if maybe_proto is not None:
             return maybe_proto
 
         # ltrace.conf - demangled
-        maybe_proto = self.ltrace_info.get_proto(func_name)
+        maybe_proto = self._ltrace_proto(LTRACE, func_name)
         if maybe_proto is not None:
             return maybe_proto
 
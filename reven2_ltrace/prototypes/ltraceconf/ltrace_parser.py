@@ -1,13 +1,22 @@
 """Parser for ltrace.conf
+
+The parser tables and the parsed files are pickled in the cache directory.
 """
 
+import hashlib
+import os
+import pickle
+
 import ply.yacc as yacc
 
+from ... import cache
 from .ltrace_lexer import *  # noqa: F403
 from . import ltrace_expression as Expression
 
-parsetab_tabmodule = "rvnltrace_parsetab"
-parsetab_outputdir = "/tmp"
+# bump when the grammar actions or ltrace_expression change
+PARSED_VERSION = 1
+
+_parser = None
 
 typedefs = {}
 
@@ -210,15 +219,73 @@ def p_error(p):
     raise RuntimeError("Syntax error at EOF")
 
 
-def parse_ltrace_conf_file(filepath):
-    lexer = lex.lex()  # noqa: F405, F841
-    parser = yacc.yacc(
-        tabmodule=parsetab_tabmodule, outputdir=parsetab_outputdir
+def get_parser():
+    """Return the shared parser, built from cached tables if possible"""
+    global _parser
+    if _parser is None:
+        lex.lex()  # noqa: F405
+        cache_path = cache.cache_dir("ply")
+        _parser = yacc.yacc(
+            debug=False,
+            write_tables=cache_path is not None,
+            picklefile=(
+                None
+                if cache_path is None
+                else os.path.join(cache_path, "ltrace_parsetab.pickle")
+            ),
+        )
+    return _parser
+
+
+def _parsed_path(source):
+    parsed_dir = cache.cache_dir("ltraceconf")
+    if parsed_dir is None:
+        return None
+    # types may be defined by previously parsed files, the parse depends on
+    # their definitions
+    definitions = sorted(
+        "{}={!r}".format(name, definition)
+        for name, definition in typedefs.items()
     )
+    key = hashlib.sha1(
+        "{}\0{}\0{}".format(PARSED_VERSION, definitions, source).encode(
+            "utf-8"
+        )
+    )
+    return os.path.join(parsed_dir, key.hexdigest() + ".pickle")
 
+
+def parse_ltrace_conf_file(filepath):
     with open(filepath, "r") as f:
-        result = parser.parse(f.read())
-        return result
+        source = f.read()
+
+    parsed_path = _parsed_path(source)
+    if parsed_path is not None:
+        try:
+            with open(parsed_path, "rb") as f:
+                result, file_typedefs = pickle.load(f)
+            typedefs.update(file_typedefs)
+            return result
+        except (
+            OSError,
+            pickle.PickleError,
+            EOFError,
+            AttributeError,
+            ImportError,
+        ):
+            pass
+
+    result = get_parser().parse(source)
+
+    if parsed_path is not None:
+        parsed = (result, typedefs)
+        try:
+            cache.replace_file(
+                parsed_path, lambda f: pickle.dump(parsed, f, protocol=4)
+            )
+        except (OSError, pickle.PickleError):
+            pass
+    return result
 
 
 if __name__ == "__main__":
@@ -13,9 +13,24 @@ from .ltrace_expression import (
 )
 
 
+# ltrace.conf types holding a pointer, their declared size is the x86 one
+_POINTER_TYPES = ("addr", "file")
+
+
+def _type_size(node):
+    """Return the size of the type node, None for pointers to let the
+    argument plan use the pointer size of the call
+    """
+    if node.name in _POINTER_TYPES or getattr(node, "is_pointer", False):
+        return None
+    return node.get_size()
+
+
 class LTraceConf:
     def __init__(self, ltrace_file):
         self.functions = parse_ltrace_conf_file(ltrace_file)
+        # name -> proto, built once per function
+        self._protos = {}
 
     def _make_arg(self, func_arg):
         arg_name = None  # no arg name in ltrace.conf
@@ -32,7 +47,7 @@ class LTraceConf:
             type_format = lens.lens
             type_name = "{}({})".format(lens.lens, node.name)
             real_type_name = node.name
-            type_size = node.get_size()
+            type_size = _type_size(node)
         elif isinstance(node, StringExpression):
             type_format = "string"
             type_name = "string"
@@ -41,7 +56,7 @@ class LTraceConf:
         elif isinstance(node, EnumExpression):
             type_format = "int"
             type_name = str(node)
-            real_type_name = node.type
+            real_type_name = str(node.type)
             type_size = node.type.get_size()
         elif isinstance(node, ArrayExpression):
             type_format = "addr"
@@ -57,7 +72,7 @@ class LTraceConf:
             type_format = node.name
             type_name = node.name
             real_type_name = str(node)  # node.name
-            type_size = node.get_size()
+            type_size = _type_size(node)
 
         return prototype.PrototypeType(
             name=type_name,
@@ -67,21 +82,19 @@ class LTraceConf:
         )
 
     def _make_proto(self, function):
-        proto = prototype.Prototype()
-        proto.name = function.name
-        proto.full_proto = str(function)
-
-        proto.return_type = self._make_type(function.return_type)
-
-        for func_arg in function.args:
-            proto_arg = self._make_arg(func_arg)
-            proto.add_argument(proto_arg)
-
-        return proto
+        return prototype.Prototype(
+            str(function),
+            name=function.name,
+            return_type=self._make_type(function.return_type),
+            args=[self._make_arg(func_arg) for func_arg in function.args],
+        )
 
     def get_proto(self, symbol_name):
         if symbol_name not in self.functions:
             return None
 
-        function = self.functions[symbol_name]
-        return self._make_proto(function)
+        proto = self._protos.get(symbol_name)
+        if proto is None:
+            proto = self._make_proto(self.functions[symbol_name])
+            self._protos[symbol_name] = proto
+        return proto
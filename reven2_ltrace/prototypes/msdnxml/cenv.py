@@ -1,6 +1,30 @@
+import functools
+import hashlib
+import os
+import re
+from io import StringIO
+from sys import stderr
+
+from pcpp import Preprocessor
+
+from ... import cache
 from . import typesconf
 
 
+# bump when the generation of the prelude changes
+PRELUDE_VERSION = 1
+
+
+def preprocess(sources, source_name="proto.hpp"):
+    cpp = Preprocessor()
+    cpp.parse(StringIO(sources), source=source_name)
+    sstr = StringIO()
+    cpp.write(sstr)
+    src = sstr.getvalue()
+    sstr.close()
+    return src
+
+
 def generate_defines(defineslist):
     return "\n".join(
         [
@@ -40,6 +64,59 @@ class CEnv(object):
     def __init__(self, types=None):
         self._typesconf = types if type is not None else typesconf.TypesConf()
         self._ctypedefs = generate_c_typedefs(self._typesconf.typedefs)
+        self._prelude = None
+        # all the defines of typesconf are empty
+        names = [re.escape(define) for define, _ in self._typesconf.defines]
+        self._defines_re = (
+            re.compile(r"\b(?:{})\b".format("|".join(names)))
+            if names
+            else None
+        )
+
+    def _prelude_path(self, sources):
+        prelude_dir = cache.cache_dir("clang")
+        if prelude_dir is None:
+            return None
+        key = hashlib.sha1(
+            "{}\0{}".format(PRELUDE_VERSION, sources).encode("utf-8")
+        )
+        name = "prelude-{}.h".format(key.hexdigest())
+        return os.path.join(prelude_dir, name)
+
+    def prelude(self):
+        """Return the defines and typedefs, preprocessed once"""
+        if self._prelude is not None:
+            return self._prelude
+
+        sources = "{defines}\n{typedefs}\n".format(
+            defines=generate_defines(self.defines()), typedefs=self.typedefs()
+        )
+        path = self._prelude_path(sources)
+        if path is not None:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self._prelude = f.read()
+                    return self._prelude
+            except OSError:
+                pass
+
+        self._prelude = preprocess(sources, "prelude.hpp")
+        if path is not None:
+            content = self._prelude.encode("utf-8")
+            try:
+                cache.replace_file(path, lambda f: f.write(content))
+            except OSError as e:
+                print(
+                    "WAR: Cannot save prelude {}: {}".format(path, e),
+                    file=stderr,
+                )
+        return self._prelude
+
+    def expand_defines(self, src):
+        """Remove the (empty) defines from src"""
+        if self._defines_re is None:
+            return src
+        return self._defines_re.sub("", src)
 
     def defines(self):
         return self._typesconf.defines
@@ -51,6 +128,8 @@ class CEnv(object):
         return self._typesconf.type_format(type_name, real_type_name)
 
 
+@functools.lru_cache(maxsize=None)
 def cenv_from_typesconf_file(typesconf_path):
+    """Return the CEnv of typesconf_path, parsed once per process"""
     tconf = typesconf.TypesConf(typesconf_path)
     return CEnv(tconf)
@@ -1,13 +1,18 @@
+import hashlib
+import os
+import re
 from sys import stderr
-from pcpp import Preprocessor
-from io import StringIO
 
 from reven2.preview.prototypes import RevenPrototypes
 
+from ... import cache
 from .. import prototype
 from . import cenv
 
 
+_identifier_re = re.compile(r"\w+")
+
+
 class Diagnostic(object):
     def __init__(self, tu):
         self._unknown_types = tu.unknown_types
@@ -39,60 +44,150 @@ class ClangParser(object):
             name=arg.name, type=self.parse_type(arg.type)
         )
 
-    def parse_func(self, f, proto):
-        proto.name = f.name
-        proto.return_type = self.parse_type(f.return_type)
-        for arg in f.parameters:
-            proto.add_argument(self.parse_arg(arg))
+    def parse_func(self, f, proto_src="", callconv=None):
+        return prototype.Prototype(
+            proto_src,
+            callconv,
+            name=f.name,
+            return_type=self.parse_type(f.return_type),
+            args=[self.parse_arg(arg) for arg in f.parameters],
+        )
 
-    def parse_tu(self, tu, proto):
+    def parse_tu(self, tu, proto_src="", callconv=None):
+        """Return the proto of the last function of tu"""
+        proto = prototype.Prototype(proto_src, callconv)
         for f in tu.functions:
-            self.parse_func(f, proto)
-
-    def patch_sources(self, proto_src):
-        return "{defines}\n{typedefs}\n{extra_typedefs}\n{proto}\n".format(
-            defines=cenv.generate_defines(self._cenv.defines()),
-            typedefs=self._cenv.typedefs(),
-            extra_typedefs=cenv.generate_c_typedefs(self._extra_typedefs),
-            proto=cenv.cpp_compat(proto_src),
-        )
+            proto = self.parse_func(f, proto_src, callconv)
+        return proto
 
     def preprocess_sources(self, sources):
-        cpp = Preprocessor()
-        cpp.parse(StringIO(sources), source="proto.hpp")
-        sstr = StringIO()
-        cpp.write(sstr)
-        src = sstr.getvalue()
-        sstr.close()
-        return src
+        return cenv.preprocess(sources)
 
     def preprocess(self, proto_src):
-        src = self.patch_sources(proto_src)
-        return self.preprocess_sources(src)
+        """Return the prelude followed by the preprocessed proto_src.
+
+        The prelude is preprocessed once per CEnv, and proto_src only goes
+        through the preprocessor if it has directives once the defines of
+        the prelude are expanded.
+        """
+        snippet = self._cenv.expand_defines(
+            "{extra_typedefs}\n{proto}\n".format(
+                extra_typedefs=cenv.generate_c_typedefs(self._extra_typedefs),
+                proto=cenv.cpp_compat(proto_src),
+            )
+        )
+        if "#" in snippet:
+            snippet = self.preprocess_sources(snippet)
+        return self._cenv.prelude() + snippet
 
     def parse_proto(self, proto_src, callconv=None):
-        proto = prototype.Prototype(proto_src, callconv)
         src = self.preprocess(proto_src)
 
         tu = RevenPrototypes(self._reven).parse_translation_unit(src)
 
-        self.parse_tu(tu, proto)
+        proto = self.parse_tu(tu, proto_src, callconv)
         self.proto = proto
         self.diag = Diagnostic(tu)
 
         return proto
 
+    def parse_protos(self, proto_srcs):
+        """Parse proto_srcs in a single translation unit.
+
+        Return {function name: proto}, the first declaration of a name wins.
+        """
+        src = self.preprocess("\n".join(proto_srcs))
+
+        tu = RevenPrototypes(self._reven).parse_translation_unit(src)
+
+        protos = {}
+        for f in tu.functions:
+            protos.setdefault(f.name, self.parse_func(f))
+        self.diag = Diagnostic(tu)
+
+        return protos
+
 
 class ProtoStrParser:
+    """Create ClangParser for a typesconf file
+
+    Types found unknown by clang are learned and persisted in the cache
+    directory. They are defined as addr in every later parser, so that the
+    prototypes using them are parsed once.
+    """
+
     def __init__(self, srv, typesconf_file):
         self._reven_server = srv
         self._typesconf_file = typesconf_file
+        self._unknown_types = None
+        self.reparses = 0
+        self.reparses_avoided = 0
+
+    def _unknown_types_path(self):
+        types_dir = cache.cache_dir("clang")
+        if types_dir is None:
+            return None
+        try:
+            with open(self._typesconf_file, "rb") as f:
+                key = hashlib.sha1(f.read()).hexdigest()
+        except OSError:
+            return None
+        return os.path.join(types_dir, "unknown-types-{}.txt".format(key))
+
+    def _read_unknown_types(self, path):
+        try:
+            with open(path, "r") as f:
+                return set(line.strip() for line in f if line.strip())
+        except OSError:
+            return set()
+
+    @property
+    def unknown_types(self):
+        """Set of the type names learned to be unknown"""
+        if self._unknown_types is None:
+            path = self._unknown_types_path()
+            self._unknown_types = (
+                set() if path is None else self._read_unknown_types(path)
+            )
+        return self._unknown_types
+
+    def learn_unknown_types(self, types):
+        new_types = set(types) - self.unknown_types
+        if not new_types:
+            return
+        self._unknown_types |= new_types
+
+        path = self._unknown_types_path()
+        if path is None:
+            return
+        # types learned by other processes meanwhile
+        self._unknown_types |= self._read_unknown_types(path)
+        content = "".join(
+            "{}\n".format(t) for t in sorted(self._unknown_types)
+        ).encode("utf-8")
+        try:
+            cache.replace_file(path, lambda f: f.write(content))
+        except OSError as e:
+            print(
+                "WAR: Cannot save unknown types {}: {}".format(path, e),
+                file=stderr,
+            )
+
+    def uses_unknown_types(self, proto_str):
+        """True if proto_str uses a type learned to be unknown"""
+        unknown_types = self.unknown_types
+        return any(
+            name in unknown_types for name in _identifier_re.findall(proto_str)
+        )
 
     def clang(self):
-        return ClangParser(self._reven_server, self._typesconf_file)
+        clang_parser = ClangParser(self._reven_server, self._typesconf_file)
+        for t in sorted(self.unknown_types):
+            clang_parser.add_typedef(t, "addr")
+        return clang_parser
 
     def parse_proto(self, proto_str, callconv=None):
-        clang_parser = ClangParser(self._reven_server, self._typesconf_file)
+        clang_parser = self.clang()
         clang_parser.parse_proto(proto_str, callconv)
         return clang_parser
 
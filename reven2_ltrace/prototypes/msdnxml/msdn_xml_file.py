@@ -1,29 +1,134 @@
 """Parse msdn.xml to retrieve function prototypes
+
+msdn.xml is not loaded as a whole: the byte span of each `<fct>` node is
+indexed by function name once, in the cache directory if caching is on,
+and only the nodes of the looked up functions are read and parsed.
 """
 
+import hashlib
+import mmap
+import os
+import re
 import xml.etree.ElementTree as ET
 from sys import stderr
+from xml.sax.saxutils import unescape
+
+from ... import cache
+
+
+INDEX_VERSION = 1
+
+_fct_re = re.compile(rb"<fct>.*?</fct>", re.DOTALL)
+_name_re = re.compile(rb"<name>\s*(.*?)\s*</name>", re.DOTALL)
+
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return "{} {} {}".format(INDEX_VERSION, stat.st_size, stat.st_mtime_ns)
 
 
 class MsdnXmlFile(object):
     def __init__(self, msdn_path):
+        self._msdn_path = msdn_path
+        # name -> (offset, size) of its <fct> node, None until loaded
+        self._index = None
+        self._xml = None
+
+    def _index_path(self):
+        index_dir = cache.cache_dir("msdn")
+        if index_dir is None:
+            return None
+        name = os.path.abspath(self._msdn_path).encode("utf-8")
+        return os.path.join(index_dir, hashlib.sha1(name).hexdigest() + ".idx")
+
+    def _read_index(self, index_path, stamp):
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                if f.readline().rstrip("\n") != stamp:
+                    return None
+                index = {}
+                for line in f:
+                    name, offset, size = line.rstrip("\n").split("\t")
+                    index[name] = (int(offset), int(size))
+                return index
+        except (OSError, ValueError):
+            return None
+
+    def _build_index(self):
+        index = {}
+        for match in _fct_re.finditer(self._xml):
+            name = _name_re.search(match.group())
+            if name is None:
+                continue
+            name = unescape(name.group(1).decode("utf-8"))
+            # the first node wins, as with an XPath find
+            index.setdefault(
+                name, (match.start(), match.end() - match.start())
+            )
+        return index
+
+    def _write_index(self, index_path, stamp, index):
+        def write(f):
+            f.write("{}\n".format(stamp).encode("utf-8"))
+            for name, (offset, size) in index.items():
+                f.write(
+                    "{}\t{}\t{}\n".format(name, offset, size).encode("utf-8")
+                )
+
+        cache.replace_file(index_path, write)
+
+    def _load(self):
         try:
-            self._msdn_tree = ET.parse(msdn_path)
-        except Exception as e:
+            stamp = _file_stamp(self._msdn_path)
+            with open(self._msdn_path, "rb") as f:
+                self._xml = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
             print(
-                "Error loading msdn db {}: {}".format(msdn_path, e),
+                "Error loading msdn db {}: {}".format(self._msdn_path, e),
                 file=stderr,
             )
-            self._msdn_tree = None
+            self._index = {}
+            return
+
+        index_path = self._index_path()
+        if index_path is not None:
+            self._index = self._read_index(index_path, stamp)
+            if self._index is not None:
+                return
+
+        self._index = self._build_index()
+        if index_path is not None:
+            try:
+                self._write_index(index_path, stamp, self._index)
+            except OSError:
+                pass
+
+    def _function_node(self, name):
+        if self._index is None:
+            self._load()
+        span = self._index.get(name)
+        if span is None:
+            return None
+        offset, size = span
+        return ET.fromstring(self._xml[offset : offset + size])  # noqa: E203
+
+    @staticmethod
+    def _proto_str(function_node):
+        proto_str = function_node.find("proto").text
+        if "//" in proto_str:
+            # malformed prototype in msdn.xml
+            return None
+        return proto_str
 
     def function_proto_str(self, symbol_name):
-        function_key = "./fcts/fct/[name='{}']".format(symbol_name)
         try:
-            function_node = self._msdn_tree.getroot().find(function_key)
-            proto_str = function_node.find("proto").text
-            if "//" in proto_str:
-                # malformed prototype in msdn.xml
-                return None
-            return proto_str
+            return self._proto_str(self._function_node(symbol_name))
         except Exception:
             return None
+
+    def functions(self):
+        """Generate (name, proto_str) for each function of msdn.xml"""
+        if self._index is None:
+            self._load()
+        for name in list(self._index):
+            yield (name, self.function_proto_str(name))
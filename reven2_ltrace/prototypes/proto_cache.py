@@ -0,0 +1,144 @@
+"""Persistent cache of the prototypes resolved for symbols
+
+Prototypes, or their absence, are stored in the cache directory by
+(symbol name, demangled name, resources key), so later runs with the same
+resource files do not parse them again. The least recently used entries
+are evicted above MAX_ENTRIES.
+
+The database is shared by the parallel workers: it is in WAL mode, new
+entries are committed right away and cache hits only write when flushed.
+"""
+
+import os
+import sqlite3
+import time
+from sys import stderr
+
+from .. import cache
+from .prototype_db import proto_from_json, proto_to_json
+
+
+# number of entries kept on disk
+MAX_ENTRIES = 100000
+
+
+class ProtoCache(object):
+    def __init__(self, db_path, key):
+        self._key = key
+        # key -> last use of the entries hit since the last flush
+        self._used = {}
+        self.hits = 0
+        # parallel workers share the db, each statement is its own
+        # transaction unless flushed together
+        self._db = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS prototypes ("
+                "resources TEXT, name TEXT, demangled TEXT, proto TEXT, "
+                "used REAL, PRIMARY KEY (resources, name, demangled))"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS prototypes_used "
+                "ON prototypes (used)"
+            )
+        self._evict()
+
+    def _evict(self):
+        (count,) = self._db.execute(
+            "SELECT COUNT(*) FROM prototypes"
+        ).fetchone()
+        if count <= MAX_ENTRIES:
+            return
+        with self._db:
+            self._db.execute(
+                "DELETE FROM prototypes WHERE rowid IN ("
+                "SELECT rowid FROM prototypes ORDER BY used LIMIT ?)",
+                (count - MAX_ENTRIES,),
+            )
+
+    def _key_of(self, name, demangled_name):
+        # NULL never matches in a primary key
+        return (self._key, name, demangled_name or "")
+
+    def _error(self, e):
+        if self._db is not None:
+            print("WAR: Prototype cache disabled: {}".format(e), file=stderr)
+        self._db = None
+
+    def get(self, name, demangled_name, count=True):
+        """Return (found, proto) for the symbol, proto may be None.
+
+        The hit is counted in hits only if count is True.
+        """
+        key = self._key_of(name, demangled_name)
+        row = None
+        if self._db is not None:
+            try:
+                row = self._db.execute(
+                    "SELECT proto FROM prototypes "
+                    "WHERE resources = ? AND name = ? AND demangled = ?",
+                    key,
+                ).fetchone()
+            except sqlite3.Error as e:
+                self._error(e)
+        if row is None:
+            return (False, None)
+
+        if count:
+            self.hits += 1
+        self._used[key] = time.time()
+        if row[0] is None:
+            return (True, None)
+        return (True, proto_from_json(row[0]))
+
+    def put(self, name, demangled_name, proto):
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO prototypes VALUES (?, ?, ?, ?, ?)",
+                self._key_of(name, demangled_name)
+                + (
+                    None if proto is None else proto_to_json(proto),
+                    time.time(),
+                ),
+            )
+        except sqlite3.Error as e:
+            self._error(e)
+
+    def flush(self):
+        """Write the last use of the entries hit, in one transaction"""
+        used, self._used = self._used, {}
+        if self._db is None or not used:
+            return
+        try:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "UPDATE prototypes SET used = ? "
+                "WHERE resources = ? AND name = ? AND demangled = ?",
+                [(last_use,) + key for key, last_use in used.items()],
+            )
+            self._db.execute("COMMIT")
+        except sqlite3.Error as e:
+            if self._db.in_transaction:
+                self._db.rollback()
+            self._error(e)
+
+
+def open_proto_cache(key):
+    """Open the prototype cache for key, None if caching is off"""
+    cache_path = cache.cache_dir("prototypes")
+    if cache_path is None:
+        return None
+
+    db_path = os.path.join(cache_path, "prototypes.sqlite")
+    try:
+        return ProtoCache(db_path, key)
+    except sqlite3.Error as e:
+        print(
+            "WAR: Cannot open prototype cache {}: {}".format(db_path, e),
+            file=stderr,
+        )
+        return None
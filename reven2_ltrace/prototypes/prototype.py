@@ -1,4 +1,7 @@
 """Abstract prototype info from any source (ltrace.conf or msdn)
+
+Prototype objects are immutable and hashable. Types and arguments are
+interned: equal ones are the same object.
 """
 
 
@@ -7,12 +10,59 @@ def void_arg(type_name, real_type_name):
     return PrototypeArgument(name=None, type=arg_type)
 
 
-class PrototypeType(object):
-    def __init__(self, name=None, real_type=None, format=None, size=None):
-        self.name = name
-        self.real_type = real_type
-        self.format = format
-        self.size = size
+class _Frozen(object):
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError("{} is immutable".format(type(self).__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError("{} is immutable".format(type(self).__name__))
+
+    def _set(self, **values):
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def _key(self):
+        return tuple(getattr(self, name) for name in self._fields)
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __reduce__(self):
+        return (type(self), self._key())
+
+
+# interned types and arguments
+_interned = {}
+
+
+def _intern(cls, key):
+    try:
+        return _interned[(cls, key)]
+    except KeyError:
+        value = object.__new__(cls)
+        value._set(**dict(zip(cls._fields, key)))
+        return _interned.setdefault((cls, key), value)
+
+
+class PrototypeType(_Frozen):
+    _fields = ("name", "real_type", "format", "size")
+    __slots__ = _fields
+
+    def __new__(cls, name=None, real_type=None, format=None, size=None):
+        return _intern(cls, (name, real_type, format, size))
 
     def __str__(self):
         return "Type(name={}, real_type={}, size={}, format={})".format(
@@ -20,10 +70,14 @@ class PrototypeType(object):
         )
 
 
-class PrototypeArgument(object):
-    def __init__(self, name=None, type=None):
-        self.name = name
-        self.type = type if type is not None else PrototypeType()
+class PrototypeArgument(_Frozen):
+    _fields = ("name", "type")
+    __slots__ = _fields
+
+    def __new__(cls, name=None, type=None):
+        return _intern(
+            cls, (name, type if type is not None else PrototypeType())
+        )
 
     def is_void(self):
         return (
@@ -36,16 +90,41 @@ class PrototypeArgument(object):
         return "Argument(name={}, type={})".format(self.name, self.type)
 
 
-class Prototype(object):
-    def __init__(self, src="", callconv=None):
-        self.args = []
-        self.name = None
-        self.return_type = PrototypeType()
-        self.full_proto = src
-        self.callconv = callconv
+class Prototype(_Frozen):
+    _fields = ("full_proto", "callconv", "name", "return_type", "args")
+    # prototypes are used as keys of per-call caches
+    __slots__ = _fields + ("_hash",)
+
+    def __new__(
+        cls, src="", callconv=None, name=None, return_type=None, args=()
+    ):
+        proto = object.__new__(cls)
+        proto._set(
+            full_proto=src,
+            callconv=callconv,
+            name=name,
+            return_type=(
+                return_type if return_type is not None else PrototypeType()
+            ),
+            args=tuple(args),
+        )
+        proto._set(_hash=hash(proto._key()))
+        return proto
 
-    def add_argument(self, arg):
-        self.args.append(arg)
+    def __hash__(self):
+        return self._hash
+
+    def replace(self, **changes):
+        """Return a copy of the prototype with the given fields changed"""
+        fields = dict(zip(self._fields, self._key()))
+        fields.update(changes)
+        return Prototype(
+            fields["full_proto"],
+            fields["callconv"],
+            fields["name"],
+            fields["return_type"],
+            fields["args"],
+        )
 
     def __str__(self):
         return "{} {} {}({}) from {}".format(
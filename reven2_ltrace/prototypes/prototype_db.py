@@ -0,0 +1,170 @@
+"""Database of the prototypes of the resource files, resolved ahead of time
+
+The database is built by `python -m reven2_ltrace.prototypes.build_db` in
+the cache directory, since it needs a REVEN server to parse the prototypes,
+and maps each function of msdn.xml, ltrace.conf and ltrace-extra.conf to its
+serialized prototype, or to NULL when it cannot be parsed. It is only used
+when the hashes of the resource files match the ones it was built from.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from sys import stderr
+
+from .. import cache
+from . import prototype
+
+
+DB_VERSION = 3
+
+# sources of prototypes, by their resource name
+MSDN = "msdn"
+LTRACE = "ltrace"
+LTRACE_EXTRA = "ltrace-extra"
+
+
+def default_db_path():
+    """Return the path of the database in the cache directory, None if
+    caching is off
+    """
+    db_dir = cache.cache_dir("prototype-db")
+    if db_dir is None:
+        return None
+    return os.path.join(db_dir, "prototypes.sqlite")
+
+
+def file_hash(path):
+    """Return the sha1 of the file at path, or None if it cannot be read"""
+    sha1 = hashlib.sha1()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha1.update(chunk)
+    except OSError:
+        return None
+    return sha1.hexdigest()
+
+
+def resources_key(*resources):
+    """Return a key of the content of the resource files"""
+    return json.dumps([DB_VERSION] + [file_hash(path) for path in resources])
+
+
+def _str_or_none(value):
+    return None if value is None else str(value)
+
+
+def _type_to_json(proto_type):
+    # ltrace.conf types may be named by expressions, only displayed
+    return [
+        _str_or_none(proto_type.name),
+        _str_or_none(proto_type.real_type),
+        _str_or_none(proto_type.format),
+        proto_type.size,
+    ]
+
+
+def _type_from_json(value):
+    name, real_type, format, size = value
+    return prototype.PrototypeType(
+        name=name, real_type=real_type, format=format, size=size
+    )
+
+
+def proto_to_json(proto):
+    return json.dumps(
+        [
+            proto.name,
+            proto.full_proto,
+            proto.callconv,
+            _type_to_json(proto.return_type),
+            [[arg.name, _type_to_json(arg.type)] for arg in proto.args],
+        ]
+    )
+
+
+def proto_from_json(value, callconv=None):
+    """Return the proto of value, with callconv if not None"""
+    name, full_proto, proto_callconv, return_type, args = json.loads(value)
+    return prototype.Prototype(
+        full_proto,
+        callconv or proto_callconv,
+        name=name,
+        return_type=_type_from_json(return_type),
+        args=[
+            prototype.PrototypeArgument(
+                name=arg_name, type=_type_from_json(arg_type)
+            )
+            for arg_name, arg_type in args
+        ],
+    )
+
+
+class PrototypeDB(object):
+    """Read-only access to a prototype database"""
+
+    def __init__(self, db_path, key):
+        self._db = None
+        try:
+            db = sqlite3.connect(
+                "file:{}?mode=ro".format(db_path), uri=True
+            )
+            row = db.execute(
+                "SELECT value FROM meta WHERE name = 'resources'"
+            ).fetchone()
+        except sqlite3.Error:
+            return
+
+        if row is None or row[0] != key:
+            print(
+                "WAR: Prototype db {} is out of date, "
+                "prototypes are resolved at run time".format(db_path),
+                file=stderr,
+            )
+            db.close()
+            return
+        self._db = db
+
+    def is_valid(self):
+        return self._db is not None
+
+    def lookup(self, source, name, callconv=None):
+        """Return (found, proto) for the function name of source.
+
+        proto is None if the function is known but cannot be parsed.
+        """
+        row = self._db.execute(
+            "SELECT proto FROM prototypes WHERE source = ? AND name = ?",
+            (source, name),
+        ).fetchone()
+        if row is None:
+            return (False, None)
+        if row[0] is None:
+            return (True, None)
+        return (True, proto_from_json(row[0], callconv))
+
+
+def write_db(db_path, key, entries):
+    """Write the database at db_path from (source, name, proto) entries"""
+    db = sqlite3.connect(db_path)
+    with db:
+        db.execute("CREATE TABLE meta (name TEXT PRIMARY KEY, value TEXT)")
+        db.execute(
+            "CREATE TABLE prototypes (source TEXT, name TEXT, proto TEXT, "
+            "PRIMARY KEY (source, name)) WITHOUT ROWID"
+        )
+        db.executemany(
+            "INSERT OR REPLACE INTO prototypes VALUES (?, ?, ?)",
+            (
+                (
+                    source,
+                    name,
+                    None if proto is None else proto_to_json(proto),
+                )
+                for source, name, proto in entries
+            ),
+        )
+        db.execute("INSERT INTO meta VALUES ('resources', ?)", (key,))
+    db.close()
@@ -0,0 +1,164 @@
+"""Argument extraction plans per prototype and calling convention
+
+A plan tells which registers hold the arguments of a prototype and which
+span of the stack holds the others. It is compiled once per prototype and
+calling convention, then each call reads every register once and the
+whole stack span with a single memory read.
+"""
+
+import collections
+
+import reven2
+
+from . import reven_helper as rvnh
+
+
+# calling conventions
+X86_STACK = "x86-stack"  # cdecl, stdcall
+X86_FASTCALL = "x86-fastcall"
+MS_X64 = "ms-x64"
+SYSV_AMD64 = "sysv-amd64"
+
+_x64 = reven2.arch.x64
+
+# (registers, size of register args, stack offset of the first stack arg,
+# stack slot size, positional)
+# positional: the n-th argument always uses the n-th register, larger
+# arguments being passed by reference
+# TODO: [XYZ]MM registers for float arguments
+_conventions = {
+    X86_STACK: ((), 4, 4, 4, False),
+    X86_FASTCALL: ((_x64.ecx, _x64.edx), 4, 4, 4, False),
+    # stack shadow + ret address
+    MS_X64: ((_x64.rcx, _x64.rdx, _x64.r8, _x64.r9), 8, 32 + 8, 8, True),
+    SYSV_AMD64: (
+        (_x64.rdi, _x64.rsi, _x64.rdx, _x64.rcx, _x64.r8, _x64.r9),
+        8,
+        8,
+        8,
+        False,
+    ),
+}
+
+# number of plans kept
+MAX_PLANS = 4096
+
+_VOID = 0
+_REGISTER = 1
+_STACK = 2
+
+
+def select_convention(context, callconv=None, binary_path=None):
+    """Return the calling convention of a call made at context.
+
+    @param callconv: str of the msvc calling convention if known,
+        e.g. "__fastcall"
+    @param binary_path: str of the path of the called binary, used to tell
+        System V binaries apart on 64-bit
+    """
+    if context.is64b():
+        if binary_path is not None and binary_path.startswith("/"):
+            return SYSV_AMD64
+        return MS_X64
+
+    if callconv in ("__fastcall", "__vectorcall"):
+        return X86_FASTCALL
+    return X86_STACK
+
+
+def _aligned(size, alignment):
+    return -(-size // alignment) * alignment
+
+
+class ArgumentPlan(object):
+    __slots__ = ("registers", "stack_offset", "stack_sizes", "sources")
+
+    def __init__(self, proto, convention):
+        (
+            registers,
+            reg_size,
+            stack_offset,
+            slot_size,
+            positional,
+        ) = _conventions[convention]
+        self.registers = []
+        self.stack_offset = stack_offset
+        self.stack_sizes = []
+
+        sources = []
+        position = 0
+        for proto_arg in proto.args:
+            if proto_arg.is_void():
+                sources.append((_VOID, None, None))
+                continue
+
+            size = proto_arg.type.size
+            if positional:
+                in_register = position < len(registers)
+                if size is not None and size > reg_size:
+                    size = None
+            else:
+                in_register = len(self.registers) < len(registers) and (
+                    size is None or size <= reg_size
+                )
+            position += 1
+
+            if in_register:
+                sources.append((_REGISTER, len(self.registers), size))
+                self.registers.append(registers[len(self.registers)])
+                continue
+
+            if size is None or size <= 0:
+                size = slot_size
+            sources.append((_STACK, len(self.stack_sizes), size))
+            self.stack_sizes.append(_aligned(size, slot_size))
+
+        self.registers = tuple(self.registers)
+        self.stack_sizes = tuple(self.stack_sizes)
+        self.sources = tuple(sources)
+
+    def _read_stack(self, point):
+        if not self.stack_sizes:
+            return ()
+        try:
+            return rvnh.get_raw_stack_args(
+                point, self.stack_offset, self.stack_sizes
+            )
+        except RuntimeError as e:
+            rvnh.printerr(
+                "WAR: Cannot read memory arg at {}: {}".format(point, e)
+            )
+            return (None,) * len(self.stack_sizes)
+
+    def read(self, point):
+        """Return the raw value of each argument of the call at point"""
+        context = point.context_before()
+        registers = [context.read(reg, raw=True) for reg in self.registers]
+        stack = self._read_stack(point)
+
+        values = []
+        for kind, index, size in self.sources:
+            if kind == _VOID:
+                values.append(None)
+                continue
+
+            value = registers[index] if kind == _REGISTER else stack[index]
+            if value is not None and size is not None and size < len(value):
+                value = value[:size]
+            values.append(value)
+        return values
+
+
+_plans = collections.OrderedDict()
+
+
+def get_plan(proto, convention):
+    """Return the ArgumentPlan of proto, compiled once per convention"""
+    key = (proto, convention)
+    plan = _plans.get(key)
+    if plan is None:
+        plan = ArgumentPlan(proto, convention)
+        _plans[key] = plan
+        if len(_plans) > MAX_PLANS:
+            _plans.popitem(last=False)
+    return plan
@@ -1,9 +1,18 @@
 """Get binary ranges from the reven trace using the search service
+
+Ranges can be restricted to some processes by a ProcessFilter, in which case
+the entries in the binary are checked against the process of their address
+space.
 """
 
+import reven2
 import reven_api as _reven_api
 
 
+# number of matches requested to the search service per round-trip
+SEARCH_BATCH_RESULTS = 1000
+
+
 # modified from API to take a simple binary path string instead of Ossi.Binary
 def _binary_criterion(binary_path):
     criterion = _reven_api.criterion()
@@ -15,12 +24,25 @@ def _binary_criterion(binary_path):
     return criterion
 
 
-def _search_once(trace, criteria, from_context, to_context):
+def _enter_criteria(binary_path):
+    crit = _binary_criterion(binary_path)
+    crit.effect = _reven_api.criterion_effect.match
+    return [crit]
+
+
+def _search(
+    trace,
+    criteria,
+    from_context,
+    to_context,
+    max_results=SEARCH_BATCH_RESULTS,
+):
+    """Generate the contexts matching criteria, fetched in batches"""
     search_range = trace.search._search_range(from_context, to_context)
 
     request = _reven_api.search_request()
     request.max_sequences = 300000
-    request.max_results = 1
+    request.max_results = max_results
     request.forward = True
     request.need_all = True
     for crit in criteria:
@@ -29,9 +51,46 @@ def _search_once(trace, criteria, from_context, to_context):
     while search_range.begin() != search_range.end():
         results = trace._rvn.run_search_sequences(search_range, request)
         for match in results.content:
-            return trace.context_before(match.transition_id)
+            yield trace.context_before(match.transition_id)
         search_range = results.remaining_range
 
+
+def _enter_contexts(
+    trace,
+    path,
+    from_context,
+    to_context,
+    processes=None,
+    max_results=SEARCH_BATCH_RESULTS,
+):
+    """Generate the contexts entering the binary, in the processes selected
+    by the ProcessFilter processes if not None
+    """
+    if processes is None:
+        return _search(
+            trace, _enter_criteria(path), from_context, to_context, max_results
+        )
+
+    # filtered entries, the first match may not be the first result
+    return (
+        ctxt
+        for ctxt in _search(
+            trace, _enter_criteria(path), from_context, to_context
+        )
+        if processes.matches(ctxt)
+    )
+
+
+def _search_once(trace, criteria, from_context, to_context):
+    matches = _search(trace, criteria, from_context, to_context, 1)
+    return next(matches, None)
+
+
+def _next_from(contexts, start):
+    """Consume contexts until the first one at or after start"""
+    for ctxt in contexts:
+        if ctxt >= start:
+            return ctxt
     return None
 
 
@@ -43,10 +102,17 @@ def _last_context(trace):
     return trace.context_after(trace.transition_count - 1)
 
 
-def enter_binary(trace, path, from_context=None, to_context=None):
-    crit = _binary_criterion(path)
-    crit.effect = _reven_api.criterion_effect.match
-    return _search_once(trace, [crit], from_context, to_context)
+def is_last_context(trace, context):
+    return context._id == trace.transition_count
+
+
+def enter_binary(
+    trace, path, from_context=None, to_context=None, processes=None
+):
+    entries = _enter_contexts(
+        trace, path, from_context, to_context, processes, max_results=1
+    )
+    return next(entries, None)
 
 
 def leave_binary(trace, path, from_context=None, to_context=None):
@@ -55,13 +121,59 @@ def leave_binary(trace, path, from_context=None, to_context=None):
     return _search_once(trace, [crit], from_context, to_context)
 
 
-def binary_ranges(trace, path, from_context=None, to_context=None):
-    """Generate context ranges (first, last_included) for given binary."""
-    first = enter_binary(trace, path, from_context, to_context)
+def binary_boundaries(
+    trace, path, from_context=None, to_context=None, processes=None
+):
+    """Generate (enter, leave) contexts for given binary in one forward sweep.
+
+    `enter` is the first context in the binary, `leave` the first context
+    out of it, or None if the binary is not left before `to_context`.
+    If the ProcessFilter processes is not None, only entries in the
+    selected processes are generated. Leaving the binary does not depend
+    on the process.
+
+    Both streams of boundaries are fetched from the search service in
+    batches instead of one request per boundary.
+    """
+    entries = _enter_contexts(
+        trace, path, from_context, to_context, processes
+    )
+
+    first = next(entries, None)
+    if first is None:
+        return
+
+    leave_crit = _binary_criterion(path)
+    leave_crit.effect = _reven_api.criterion_effect.invert_match
+    exits = _search(trace, [leave_crit], first, to_context)
+
     while first is not None:
-        last = leave_binary(trace, path, first, to_context)
+        leave = _next_from(exits, first)
+
+        if leave is None:
+            yield (first, None)
+            break
+
+        if leave == first:
+            # didn't leave binary. might happen if binary is '<unknown>'
+            break
 
-        if last is None:
+        yield (first, leave)
+        first = _next_from(entries, leave)
+
+
+def binary_ranges(
+    trace, path, from_context=None, to_context=None, processes=None
+):
+    """Generate context ranges (first, last_included) for given binary.
+
+    If the ProcessFilter processes is not None, only ranges of the selected
+    processes are generated.
+    """
+    for first, leave in binary_boundaries(
+        trace, path, from_context, to_context, processes
+    ):
+        if leave is None:
             last = (
                 _last_context(trace)
                 if to_context is None
@@ -70,9 +182,95 @@ def binary_ranges(trace, path, from_context=None, to_context=None):
             yield (first, last)
             break
 
-        if last == first:
-            # didn't leave binary. might happen if binary is '<unknown>'
+        yield (first, _previous_context(leave))
+
+
+def shard_ranges(
+    trace,
+    path,
+    shard_from,
+    shard_to,
+    to_context=None,
+    first_shard=False,
+    index=None,
+    processes=None,
+):
+    """Generate binary ranges for given binary starting in a trace shard.
+
+    Ranges are searched up to `to_context` so that a range starting in
+    [shard_from, shard_to[ is not cut at the shard border.
+    Unless this is the `first_shard`, a range already started before
+    `shard_from` is left to the previous shard.
+    If given, ranges are read from the range_index.BinaryRangesIndex index,
+    which must be restricted to the same processes.
+    """
+    search_from = shard_from if first_shard else _previous_context(shard_from)
+
+    if index is None:
+        ranges = binary_ranges(
+            trace, path, search_from, to_context, processes
+        )
+    else:
+        ranges = index.ranges(search_from, to_context)
+
+    for first, last in ranges:
+        if first >= shard_to:
             break
+        if first < shard_from:
+            continue
+        yield (first, last)
+
+
+class ProcessFilter(object):
+    """Select the contexts of the processes whose pid and name match.
+
+    The process of an address space is resolved through OSSI the first
+    time one of its contexts is checked, the other contexts only read
+    their cr3. Several processes match when they share a name, e.g.
+    svchost.exe. Process names are compared case insensitively.
+    """
+
+    def __init__(self, pid=None, process_name=None):
+        self.pid = pid
+        self.process_name = process_name
+        # cr3 -> whether its process matches
+        self._cr3s = {}
+
+    @property
+    def key(self):
+        """str identifying the selected processes"""
+        return "{}\0{}".format(
+            self.pid,
+            None if self.process_name is None else self.process_name.lower(),
+        )
+
+    def _matches(self, process):
+        if self.pid is not None and process.pid != self.pid:
+            return False
+        return (
+            self.process_name is None
+            or process.name.lower() == self.process_name.lower()
+        )
+
+    def matches(self, context):
+        """Return whether context runs in a selected process"""
+        cr3 = context.read(reven2.arch.x64.cr3)
+        match = self._cr3s.get(cr3)
+        if match is None:
+            try:
+                process = context.ossi.process()
+            except RuntimeError:
+                return False
+            if process is None:
+                return False
+            match = self._cr3s[cr3] = self._matches(process)
+        return match
+
 
-        yield (first, _previous_context(last))
-        first = enter_binary(trace, path, last, to_context)
+def process_filter(pid=None, process_name=None):
+    """Return the ProcessFilter of pid and process_name, None if neither is
+    given
+    """
+    if pid is None and process_name is None:
+        return None
+    return ProcessFilter(pid, process_name)
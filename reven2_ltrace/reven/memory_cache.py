@@ -0,0 +1,158 @@
+"""Page cache of the memory read to format arguments
+
+The same constant strings are passed to thousands of calls. Memory is
+read one page at a time. A cached page is reused in another context if
+the memory history shows no write to it between the contexts it is known
+valid in and that context, so pages never reused cost no query.
+"""
+
+import codecs
+import collections
+
+import reven2
+
+
+PAGE_SIZE = 0x1000
+
+# number of pages kept
+MAX_PAGES = 1024
+
+
+class _Page(object):
+    """Content of a page in the contexts [lo, hi]"""
+
+    __slots__ = ("lo", "hi", "data")
+
+    def __init__(self, lo, hi, data):
+        self.lo = lo
+        self.hi = hi
+        self.data = data
+
+
+class PageCache(object):
+    def __init__(self, maxsize=MAX_PAGES):
+        self._trace = None
+        self._pages = collections.OrderedDict()
+        self._maxsize = maxsize
+        self.pages_read = 0
+        self.bytes_fetched = 0
+        self.bytes_served = 0
+        self.write_queries = 0
+
+    def bind(self, trace):
+        """Use trace to check pages for writes.
+
+        Until bound, a page is only reused in the context it was read from.
+        """
+        if trace is not self._trace:
+            self._trace = trace
+            self.clear()
+
+    def _written(self, page, lo, hi):
+        """Return whether the page is written by transitions [lo, hi["""
+        trace = self._trace
+        self.write_queries += 1
+        accesses = trace.memory_accesses(
+            reven2.address.LogicalAddress(page),
+            PAGE_SIZE,
+            trace.transition(lo),
+            to_transition=trace.transition(hi),
+            is_forward=True,
+            operation=reven2.memhist.MemoryAccessOperation.Write,
+            fetch_count=1,
+        )
+        for access in accesses:
+            if lo <= access.transition.id < hi:
+                return True
+        return False
+
+    def _valid(self, entry, page, context_id):
+        """Return whether entry holds the page in context context_id.
+
+        The contexts in which the page is known valid are extended with a
+        single memory history query, from the closest of them.
+        """
+        if entry.lo <= context_id <= entry.hi:
+            return True
+        if self._trace is None:
+            return False
+
+        # a write at transition w is seen from context w + 1
+        if context_id > entry.hi:
+            if self._written(page, entry.hi, context_id):
+                return False
+            entry.hi = context_id
+        else:
+            if self._written(page, context_id, entry.lo):
+                return False
+            entry.lo = context_id
+        return True
+
+    def _page(self, point, cr3, page):
+        key = (cr3, page)
+        entry = self._pages.get(key)
+        if entry is not None and self._valid(entry, page, point.id):
+            self._pages.move_to_end(key)
+            return entry.data
+
+        data = point.context_before().read(
+            reven2.address.LogicalAddress(page), PAGE_SIZE, raw=True
+        )
+        self.pages_read += 1
+        self.bytes_fetched += PAGE_SIZE
+
+        self._pages[key] = _Page(point.id, point.id, data)
+        self._pages.move_to_end(key)
+        if len(self._pages) > self._maxsize:
+            self._pages.popitem(last=False)
+        return data
+
+    def _chunks(self, point, address, cr3=None):
+        """Generate the memory from address to the end of each page"""
+        if cr3 is None:
+            cr3 = point.context_before().read(reven2.arch.x64.cr3, raw=False)
+        while True:
+            page = address - address % PAGE_SIZE
+            yield self._page(point, cr3, page)[address - page :]  # noqa: E203
+            address = page + PAGE_SIZE
+
+    def read_string(
+        self, point, address, encoding, max_character_count, cr3=None
+    ):
+        """Read a NUL terminated string of encoding at address before point.
+
+        @param encoding: "utf-8" or "utf-16-le"
+        @param cr3: int of the cr3 of the context before point, read if None
+        """
+        unit = 2 if encoding == "utf-16-le" else 1
+        # a utf-8 character is up to 4 bytes
+        limit = max_character_count * (unit if unit == 2 else 4)
+        terminator = b"\0" * unit
+
+        data = bytearray()
+        end = None
+        for chunk in self._chunks(point, address, cr3):
+            start = len(data) - len(data) % unit
+            data += chunk[: limit - len(data)]
+            end = data.find(terminator, start)
+            while end >= 0 and end % unit:
+                end = data.find(terminator, end + 1)
+            if end >= 0 or len(data) >= limit:
+                break
+
+        terminated = end >= 0
+        if terminated:
+            data = data[:end]
+        self.bytes_served += len(data) + (unit if terminated else 0)
+
+        decoder = codecs.getincrementaldecoder(encoding)()
+        return decoder.decode(bytes(data), final=terminated)[
+            :max_character_count
+        ]
+
+    def clear(self):
+        self._pages.clear()
+
+
+# shared by all calls of the process
+memory_cache = PageCache()
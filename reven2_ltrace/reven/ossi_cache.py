@@ -0,0 +1,65 @@
+"""Cache of ossi locations
+
+The same few hundred entry points are called over and over in a trace.
+Their ossi location is resolved once per (pc, address space) pair.
+"""
+
+import collections
+
+import reven2
+
+
+# number of locations kept
+MAX_LOCATIONS = 4096
+
+
+def location_key(context):
+    """Return the (pc, cr3) key of the location of context"""
+    pc = reven2.arch.x64.rip if context.is64b() else reven2.arch.x64.eip
+    return (
+        context.read(pc, raw=False),
+        context.read(reven2.arch.x64.cr3, raw=False),
+    )
+
+
+class LocationCache(object):
+    def __init__(self, maxsize=MAX_LOCATIONS):
+        self._locations = collections.OrderedDict()
+        self._maxsize = maxsize
+        self._trace = None
+        self.hits = 0
+        self.misses = 0
+
+    def bind(self, trace):
+        """Clear the cache if trace is not the trace of its locations"""
+        if trace is not self._trace:
+            self._trace = trace
+            self.clear()
+
+    def location(self, context, key=None):
+        """Same as context.ossi.location(), cached.
+
+        @param key: location_key of context, read if None
+        """
+        if key is None:
+            key = location_key(context)
+        try:
+            location = self._locations[key]
+        except KeyError:
+            self.misses += 1
+            location = context.ossi.location()
+            self._locations[key] = location
+            if len(self._locations) > self._maxsize:
+                self._locations.popitem(last=False)
+            return location
+
+        self.hits += 1
+        self._locations.move_to_end(key)
+        return location
+
+    def clear(self):
+        self._locations.clear()
+
+
+# shared by all calls of the process
+location_cache = LocationCache()
@@ -0,0 +1,266 @@
+"""Persistent index of binary ranges per trace
+
+The boundaries found by `binary_boundaries` are stored in a compact binary
+file keyed by trace identity, binary path and processes the ranges are
+restricted to, if any. Queries on contexts already
+indexed are answered from that file without touching the search service,
+queries on other contexts extend the index incrementally.
+"""
+
+import array
+import hashlib
+import os
+import struct
+from sys import stderr
+
+from .. import cache
+
+_MAGIC = b"RVNLTRNG"
+_HEADER = struct.Struct("<8sII")
+_INTERVAL = struct.Struct("<QQQ")
+
+# number of contexts indexed at once, doubled each time more are needed
+INDEX_WINDOW = 1000000
+
+# leave id of a range not left before the end of its indexed interval
+_OPEN = 2 ** 64 - 1
+
+
+def trace_key(srv):
+    """Identity of the trace served by srv"""
+    return "{}:{}".format(srv.scenario_name, srv.trace.transition_count)
+
+
+def _index_path(key, path, processes=None):
+    index_dir = cache.cache_dir("ranges")
+    if index_dir is None:
+        return None
+    name = "{}\0{}".format(key, path.lower())
+    if processes is not None:
+        name += "\0" + processes.key
+    name = name.encode("utf-8")
+    return os.path.join(index_dir, hashlib.sha1(name).hexdigest() + ".idx")
+
+
+class _Interval(object):
+    """Indexed context ids [lo, hi[ and the (enter, leave) ids found there.
+
+    leave is None if the binary is not left before hi.
+    """
+
+    def __init__(self, lo, hi, pairs):
+        self.lo = lo
+        self.hi = hi
+        self.pairs = pairs
+
+    def merge(self, other):
+        """Extend with the interval starting at self.hi"""
+        pairs = other.pairs
+        if self.pairs and self.pairs[-1][1] is None:
+            if pairs and pairs[0][0] == other.lo:
+                # still in binary at the border
+                self.pairs[-1][1] = pairs[0][1]
+                pairs = pairs[1:]
+            else:
+                self.pairs[-1][1] = other.lo
+        self.pairs.extend(pairs)
+        self.hi = other.hi
+
+
+def _first_pair_after(pairs, lo):
+    """Index of the first pair not left at context id lo"""
+    begin, end = 0, len(pairs)
+    while begin < end:
+        middle = (begin + end) // 2
+        leave = pairs[middle][1]
+        if leave is not None and leave <= lo:
+            begin = middle + 1
+        else:
+            end = middle
+    return begin
+
+
+class BinaryRangesIndex(object):
+    def __init__(self, trace, key, path, index_path=None, processes=None):
+        self._trace = trace
+        self._path = path
+        self._processes = processes
+        self._index_path = (
+            index_path
+            if index_path is not None
+            else _index_path(key, path, processes)
+        )
+        self._intervals = []
+        self._load()
+
+    def _load(self):
+        if self._index_path is None or not os.path.exists(self._index_path):
+            return
+        try:
+            with open(self._index_path, "rb") as f:
+                self._intervals = self._read(f)
+        except (OSError, ValueError, EOFError, struct.error) as e:
+            print(
+                "WAR: Ignoring ranges index {}: {}".format(
+                    self._index_path, e
+                ),
+                file=stderr,
+            )
+            self._intervals = []
+
+    @staticmethod
+    def _read(f):
+        magic, version, count = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != _MAGIC or version != cache.CACHE_VERSION:
+            raise ValueError("unknown format")
+
+        intervals = []
+        for _ in range(count):
+            lo, hi, pair_count = _INTERVAL.unpack(f.read(_INTERVAL.size))
+            ids = array.array("Q")
+            ids.fromfile(f, 2 * pair_count)
+            pairs = [
+                [ids[i], None if ids[i + 1] == _OPEN else ids[i + 1]]
+                for i in range(0, len(ids), 2)
+            ]
+            intervals.append(_Interval(lo, hi, pairs))
+        return intervals
+
+    def _write(self, f):
+        intervals = self._intervals
+        f.write(_HEADER.pack(_MAGIC, cache.CACHE_VERSION, len(intervals)))
+        for interval in intervals:
+            f.write(
+                _INTERVAL.pack(interval.lo, interval.hi, len(interval.pairs))
+            )
+            ids = array.array("Q")
+            for enter, leave in interval.pairs:
+                ids.append(enter)
+                ids.append(_OPEN if leave is None else leave)
+            ids.tofile(f)
+
+    def _save(self):
+        if self._index_path is None:
+            return
+        try:
+            cache.replace_file(self._index_path, self._write)
+        except OSError as e:
+            print(
+                "WAR: Cannot save ranges index {}: {}".format(
+                    self._index_path, e
+                ),
+                file=stderr,
+            )
+
+    def _gaps(self, lo, hi):
+        """Generate the sub-ranges of [lo, hi[ not indexed yet"""
+        for interval in self._intervals:
+            if interval.hi <= lo:
+                continue
+            if interval.lo >= hi:
+                break
+            if interval.lo > lo:
+                yield (lo, interval.lo)
+            lo = max(lo, interval.hi)
+        if lo < hi:
+            yield (lo, hi)
+
+    def _scan(self, lo, hi):
+        # only searching needs the reven2 search API, reading an index does
+        # not
+        from .binary_ranges import binary_boundaries
+
+        trace = self._trace
+        to_context = (
+            None if hi == trace.transition_count else trace._context(hi)
+        )
+        pairs = [
+            [enter._id, None if leave is None else leave._id]
+            for enter, leave in binary_boundaries(
+                trace,
+                self._path,
+                trace._context(lo),
+                to_context,
+                self._processes,
+            )
+        ]
+        return _Interval(lo, hi, pairs)
+
+    def _insert(self, new):
+        intervals = sorted(
+            self._intervals + [new], key=lambda interval: interval.lo
+        )
+        self._intervals = [intervals[0]]
+        for interval in intervals[1:]:
+            if self._intervals[-1].hi == interval.lo:
+                self._intervals[-1].merge(interval)
+            else:
+                self._intervals.append(interval)
+
+    def update(self, lo, hi):
+        """Index context ids [lo, hi[, searching only missing contexts"""
+        gaps = list(self._gaps(lo, hi))
+        for gap_lo, gap_hi in gaps:
+            self._insert(self._scan(gap_lo, gap_hi))
+        if gaps:
+            self._save()
+
+    def _covering(self, lo):
+        return next(i for i in self._intervals if i.lo <= lo < i.hi)
+
+    def ranges(self, from_context=None, to_context=None):
+        """Generate context ranges (first, last_included) for the binary.
+
+        Same as `binary_ranges`, answered from the index. Missing contexts
+        are indexed on the fly, in windows of growing size.
+        """
+        trace = self._trace
+        lo = 0 if from_context is None else from_context._id
+        hi = trace.transition_count if to_context is None else to_context._id
+        if lo >= hi:
+            return
+
+        resume = lo
+        window = INDEX_WINDOW
+        self.update(lo, min(hi, lo + window))
+        while True:
+            interval = self._covering(lo)
+            pairs = interval.pairs
+            for index in range(_first_pair_after(pairs, resume), len(pairs)):
+                enter, leave = pairs[index]
+                if enter >= hi:
+                    return
+
+                first = trace._context(max(enter, lo))
+                if leave is not None and leave < hi:
+                    yield (first, trace._context(leave - 1))
+                    resume = leave
+                elif leave is None and interval.hi < hi:
+                    # range continues after the indexed contexts
+                    break
+                else:
+                    last = (
+                        trace.context_after(trace.transition_count - 1)
+                        if to_context is None
+                        else to_context - 1
+                    )
+                    yield (first, last)
+                    return
+
+            if interval.hi >= hi:
+                return
+            window *= 2
+            self.update(lo, min(hi, interval.hi + window))
+
+
+def open_index(srv, path, processes=None):
+    """Open the ranges index of path in srv trace, None if caching is off.
+
+    If the binary_ranges.ProcessFilter processes is not None, the ranges
+    are restricted to the selected processes.
+    """
+    if cache.cache_dir() is None:
+        return None
+    return BinaryRangesIndex(
+        srv.trace, trace_key(srv), path, processes=processes
+    )
@@ -0,0 +1,157 @@
+"""Memoized memory history lookups of return address slots
+
+Calls made from the same frame, e.g. in a message loop, push their return
+address in the same stack slot. For each slot, a single forward memory
+history walk is shared by the calls using it, and is bounded to a window
+of transitions sized from the distance of the previous returns.
+
+Slots are keyed by the cr3 of the call, as processes often use the same
+stack addresses, and walked by their physical address, translated in the
+context of the call.
+"""
+
+import bisect
+import collections
+
+import reven2
+
+
+# bounds of the window of transitions searched at once
+MIN_WINDOW = 1024
+MAX_WINDOW = 1 << 26
+
+# number of accesses fetched per memory history request
+FETCH_COUNT = 64
+
+# number of slots for which a walk is kept
+MAX_SLOTS = 256
+
+# number of (slot, start) results kept
+MAX_RESULTS = 65536
+
+
+class _SlotWalk(object):
+    """Forward walk of the read accesses of a slot from transition lo"""
+
+    def __init__(self, address, lo):
+        # physical address of the slot
+        self.address = address
+        self.lo = lo
+        # ids of the read accesses in [lo, hi[
+        self.hi = lo
+        self.reads = []
+        # accesses from hi to end, None if not requested yet
+        self.accesses = None
+        self.end = lo
+
+
+class RetAccessResolver(object):
+    def __init__(self, trace):
+        self._trace = trace
+        self._window = MIN_WINDOW
+        self._walks = collections.OrderedDict()
+        self._results = collections.OrderedDict()
+        self.queries = 0
+        self.cached = 0
+        self.requests = 0
+
+    def _walk(self, slot, point, logical):
+        start = point.id
+        walk = self._walks.pop(slot, None)
+        if walk is None or start < walk.lo or start > walk.hi + self._window:
+            address = reven2.address.LogicalAddress(logical).translate(
+                point.context_after()
+            )
+            if address is None:
+                raise RuntimeError(
+                    "Cannot translate return slot {:#x}".format(logical)
+                )
+            walk = _SlotWalk(address, start)
+        self._walks[slot] = walk
+        if len(self._walks) > MAX_SLOTS:
+            self._walks.popitem(last=False)
+        return walk
+
+    def _request(self, walk, window):
+        trace = self._trace
+        walk.end = min(walk.hi + window, trace.transition_count)
+        self.requests += 1
+        walk.accesses = iter(
+            trace.memory_accesses(
+                walk.address,
+                4,
+                trace.transition(walk.hi),
+                to_transition=(
+                    None
+                    if walk.end == trace.transition_count
+                    else trace.transition(walk.end)
+                ),
+                is_forward=True,
+                operation=reven2.memhist.MemoryAccessOperation.Read,
+                fetch_count=FETCH_COUNT,
+            )
+        )
+
+    def _advance(self, walk, start):
+        """Walk the slot until the first read from start, return its id"""
+        window = self._window
+        while True:
+            if walk.accesses is None:
+                if walk.hi >= self._trace.transition_count:
+                    return None
+                self._request(walk, window)
+                window = min(2 * window, MAX_WINDOW)
+
+            for access in walk.accesses:
+                transition_id = access.transition.id
+                if transition_id < walk.hi or transition_id >= walk.end:
+                    continue
+                walk.reads.append(transition_id)
+                walk.hi = transition_id + 1
+                if transition_id >= start:
+                    return transition_id
+            else:
+                walk.hi = walk.end
+                walk.accesses = None
+
+    def _remember(self, key, transition_id):
+        self._results[key] = transition_id
+        if len(self._results) > MAX_RESULTS:
+            self._results.popitem(last=False)
+
+    def ret_access_id(self, point, logical):
+        """Return the id of the first read of logical from point, or None.
+
+        logical is the address of the slot in the context after point.
+        """
+        self.queries += 1
+        slot = (point.context_after().read(reven2.arch.x64.cr3), logical)
+        key = (slot, point.id)
+        if key in self._results:
+            self.cached += 1
+            return self._results[key]
+
+        walk = self._walk(slot, point, logical)
+        index = bisect.bisect_left(walk.reads, point.id)
+        if index < len(walk.reads):
+            transition_id = walk.reads[index]
+            self.cached += 1
+        else:
+            del walk.reads[:index]
+            walk.lo = point.id
+            transition_id = self._advance(walk, point.id)
+            if transition_id is not None:
+                self._window = max(
+                    MIN_WINDOW,
+                    min(2 * (transition_id - point.id), MAX_WINDOW),
+                )
+
+        self._remember(key, transition_id)
+        return transition_id
+
+    def ret_access(self, point, logical):
+        """Same as reven_helper.ret_access, sharing walks between calls"""
+        transition_id = self.ret_access_id(point, logical)
+        if transition_id is None:
+            return None
+        return self._trace.transition(transition_id)
@@ -0,0 +1,246 @@
+"""Pair calls leaving a binary with the point they return to it
+
+Most calls return to the traced binary when it is reentered at the pushed
+return address. Such calls are resolved from the binary ranges without
+querying the memory history, which is only used as a fallback.
+
+Pairing modes:
+- `memhist`: always query the memory history
+- `reentry`: pair each call with the next reentry
+- `stack`: track pending calls per stack, so that a call is paired with
+   its reentry even when the binary is reentered by callbacks before the
+   call returns. Stacks are told apart by address space and thread, then
+   by the distance between their stack pointers.
+"""
+
+import collections
+
+import reven2
+
+from . import reven_helper as rvnh
+from .binary_ranges import is_last_context
+from .ret_access import RetAccessResolver
+
+
+PAIRING_MODES = ["memhist", "reentry", "stack"]
+DEFAULT_PAIRING = "stack"
+
+# number of calls waiting for their ret point before the oldest is released
+MAX_PENDING_CALLS = 4096
+
+# maximum distance between stack pointers of frames on the same stack of a
+# thread, e.g. its user and kernel stacks are far apart
+STACK_WINDOW = 0x100000
+
+
+def pair_reentries(trace, ranges):
+    """Generate (call transition, reentry context) for binary ranges.
+
+    The call is the transition leaving each range, reentry is the first
+    context of the next range or None.
+    """
+    call = None
+    for first, last in ranges:
+        if call is not None:
+            yield (call, first)
+            call = None
+        if last is not None and not is_last_context(trace, last):
+            call = last.transition_after()
+
+    if call is not None:
+        yield (call, None)
+
+
+def _same_stack(sp, other_sp):
+    return abs(sp - other_sp) < STACK_WINDOW
+
+
+class _PendingCall(object):
+    def __init__(self, call):
+        self.call = call
+        self.ret_point = None
+        self.depth = 0
+        self.done = False
+        self.ret_sp = None
+        self.ret_address = None
+        self.stack_key = None
+        self.stack = None
+
+
+def _find_stack(stacks, key, sp):
+    """Return the stack of pending calls of the thread key sp belongs to,
+    None if none
+    """
+    for stack in stacks.get(key, ()):
+        if _same_stack(stack[-1].ret_sp, sp):
+            return stack
+    return None
+
+
+def _drop_if_empty(stacks, key, stack):
+    if stack:
+        return
+    others = [other for other in stacks[key] if other is not stack]
+    if others:
+        stacks[key] = others
+    else:
+        del stacks[key]
+
+
+def _pop(stacks, key, stack):
+    pending = stack.pop()
+    pending.done = True
+    _drop_if_empty(stacks, key, stack)
+    return pending
+
+
+def _match_reentry(stacks, reentry):
+    """Pair the pending call reentry returns from, if any.
+
+    Pending calls of the reentry stack are scanned from the innermost one.
+    Calls whose frame is below the reentry stack pointer were unwound and
+    are released unpaired. The scan stops at the first frame above it, so
+    each pending call is scanned once before being released.
+    """
+    try:
+        frame = rvnh.get_frame(reentry)
+        key = rvnh.get_stack_key(reentry)
+    except RuntimeError as e:
+        rvnh.printerr("WAR: Cannot read frame at {}: {}".format(reentry, e))
+        return
+
+    sp = frame[0]
+    stack = _find_stack(stacks, key, sp)
+    while stack:
+        pending = stack[-1]
+        if rvnh.frame_returns(frame, (pending.ret_sp, pending.ret_address)):
+            _pop(stacks, key, stack).ret_point = reentry.transition_before()
+            return
+        if sp <= pending.ret_sp + rvnh.MAX_ARG_BYTES:
+            # nested reentry, e.g. a callback
+            return
+        # frame unwound, e.g. by an exception
+        _pop(stacks, key, stack)
+
+
+def pair_stack_depth(trace, ranges, max_pending=MAX_PENDING_CALLS):
+    """Generate (call transition, ret transition, depth) for binary ranges.
+
+    Calls are generated in order, once paired with their ret transition or
+    with None when their frame is unwound without a matching reentry or
+    max_pending later calls are waiting. depth is the number of calls of
+    the same stack pending when the call is made.
+    """
+    # stack key -> stacks of pending calls, innermost call last
+    stacks = {}
+    order = collections.deque()
+
+    for first, last in ranges:
+        if stacks:
+            _match_reentry(stacks, first)
+
+        if last is not None and not is_last_context(trace, last):
+            pending = _PendingCall(last.transition_after())
+            order.append(pending)
+
+            if pending.call.type != reven2.trace.TransitionType.Instruction:
+                pending.done = True
+            else:
+                try:
+                    pending.ret_sp, pending.ret_address = rvnh.get_call_frame(
+                        pending.call
+                    )
+                    pending.stack_key = rvnh.get_stack_key(
+                        pending.call.context_before()
+                    )
+                except RuntimeError as e:
+                    rvnh.printerr(
+                        "WAR: Cannot read frame of `{}`: {}".format(
+                            pending.call, e
+                        )
+                    )
+                    pending.done = True
+
+            if not pending.done:
+                stack = _find_stack(stacks, pending.stack_key, pending.ret_sp)
+                if stack is None:
+                    stack = []
+                    stacks.setdefault(pending.stack_key, []).append(stack)
+                pending.depth = len(stack)
+                pending.stack = stack
+                stack.append(pending)
+
+        if len(order) > max_pending and not order[0].done:
+            oldest = order[0]
+            oldest.done = True
+            oldest.stack.remove(oldest)
+            _drop_if_empty(stacks, oldest.stack_key, oldest.stack)
+
+        while order and order[0].done:
+            pending = order.popleft()
+            yield (pending.call, pending.ret_point, pending.depth)
+
+    for pending in order:
+        yield (pending.call, pending.ret_point, pending.depth)
+
+
+class ReturnPoints(object):
+    """Resolve ret points of calls using the given pairing mode"""
+
+    def __init__(self, pairing=DEFAULT_PAIRING, max_pending=MAX_PENDING_CALLS):
+        if pairing not in PAIRING_MODES:
+            raise ValueError("Unknown pairing mode `{}`".format(pairing))
+        self._pairing = pairing
+        self._max_pending = max_pending
+        # call id -> (reentry, ret point, depth)
+        self._hints = collections.OrderedDict()
+        self.resolver = None
+        self.paired = 0
+        self.fallbacks = 0
+
+    def _hint(self, call, reentry=None, ret_point=None, depth=None):
+        self._hints[call.id] = (reentry, ret_point, depth)
+        if len(self._hints) > self._max_pending:
+            self._hints.popitem(last=False)
+
+    def calls(self, trace, ranges):
+        """Generate the transitions leaving the binary ranges.
+
+        Each call is paired with its ret point before being generated.
+        """
+        if self.resolver is None:
+            self.resolver = RetAccessResolver(trace)
+
+        if self._pairing == "stack":
+            paired = pair_stack_depth(trace, ranges, self._max_pending)
+            for call, ret_point, depth in paired:
+                self._hint(call, ret_point=ret_point, depth=depth)
+                yield call
+            return
+
+        for call, reentry in pair_reentries(trace, ranges):
+            if self._pairing == "reentry":
+                self._hint(call, reentry=reentry)
+            yield call
+
+    def depth(self, call):
+        """Number of pending calls when call is made, None if unknown"""
+        return self._hints.get(call.id, (None, None, None))[2]
+
+    def ret_point(self, call):
+        reentry, ret_point, _ = self._hints.get(call.id, (None, None, None))
+
+        if ret_point is None and reentry is not None:
+            try:
+                ret_point = rvnh.get_reentry_ret_point(call, reentry)
+            except RuntimeError as e:
+                rvnh.printerr(
+                    "WAR: Cannot pair `{}` with reentry: {}".format(call, e)
+                )
+
+        if ret_point is not None:
+            self.paired += 1
+            return ret_point
+
+        self.fallbacks += 1
+        return rvnh.get_ret_point(call, self.resolver)
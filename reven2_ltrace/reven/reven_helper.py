@@ -6,6 +6,8 @@ from sys import stderr
 
 import reven2
 
+from .memory_cache import memory_cache
+
 
 def printerr(*args, **kwargs):
     print(*args, file=stderr, **kwargs)
@@ -19,9 +21,15 @@ def read_reg_after(point, reg, raw=True):
     return point.context_after().read(reg, raw=raw)
 
 
-def symbol_after(point):
+def location_after(point):
+    return point.context_after().ossi.location()
+
+
+def symbol_after(point, location=None):
+    """Return the symbol called at point, from its ossi location if known"""
     try:
-        location = point.context_after().ossi.location()
+        if location is None:
+            location = location_after(point)
         if location is None:
             raise RuntimeError("Cannot resolve ossi location")
         if location.symbol is None:
@@ -37,32 +45,68 @@ def read_addr_before(point, address, size, raw=True):
     return point.context_before().read(a, size, raw=raw)
 
 
-# FIXME: Handle correct arg size for fastcall
-def get_int_arg(point, offset, size, is_fastcall=False, raw=False):
-    if not is_fastcall or offset > 8:
-        esp = read_reg_before(
-            point, _stack_pointer(point.context_before()), raw=False
-        )
-        arg = read_addr_before(
-            point,
-            esp + offset if not is_fastcall else esp + offset - 8,
-            size,
-            raw=raw,
-        )
+def get_raw_stack_args(point, offset, sizes):
+    """Read consecutive stack arguments of given sizes from offset.
+
+    The stack pointer is read once and all the arguments with a single
+    memory read, falling back to one read per argument on error. Arguments
+    that cannot be read are None.
+    """
+    context = point.context_before()
+    sp = context.read(_stack_pointer(context), raw=False)
+
+    try:
+        block = read_addr_before(point, sp + offset, sum(sizes), raw=True)
+    except RuntimeError:
+        return [
+            _read_stack_arg(point, sp + offset + start, size)
+            for start, size in _arg_spans(sizes)
+        ]
+
+    return [
+        block[start : start + size]  # noqa: E203
+        for start, size in _arg_spans(sizes)
+    ]
+
 
-        return arg
-    elif offset == 4:
-        return read_reg_before(point, reven2.arch.x64.ecx, raw=raw)
-    else:
-        return read_reg_before(point, reven2.arch.x64.edx, raw=raw)
+def _read_stack_arg(point, address, size):
+    try:
+        return read_addr_before(point, address, size, raw=True)
+    except RuntimeError as e:
+        printerr("WAR: Cannot read memory arg at {}: {}".format(point, e))
+        return None
 
 
-def _read_string_before(point, offset, string_type):
+def _arg_spans(sizes):
+    start = 0
+    for size in sizes:
+        yield (start, size)
+        start += size
+
+
+# max number of characters of string args
+MAX_STRING_CHARACTERS = 1000
+
+
+def _read_string_before(point, offset, encoding, cr3=None):
     if offset == 0:
         return None
-    address = reven2.address.LogicalAddress(offset)
     try:
-        return point.context_before().read(address, string_type)
+        try:
+            return memory_cache.read_string(
+                point,
+                offset,
+                _codecs[encoding],
+                MAX_STRING_CHARACTERS,
+                cr3,
+            )
+        except RuntimeError:
+            # e.g. the string ends right before an unmapped page
+            string_type = reven2.types.CString(
+                encoding=encoding, max_character_count=MAX_STRING_CHARACTERS
+            )
+            address = reven2.address.LogicalAddress(offset)
+            return point.context_before().read(address, string_type)
     except RuntimeError as e:
         printerr("WAR: Cannot read string arg at {}: {}".format(point, e))
         return None
@@ -71,18 +115,22 @@ def _read_string_before(point, offset, string_type):
         return None
 
 
-def get_string_arg(point, address_offset):
-    String1000 = reven2.types.CString(
-        encoding=reven2.types.Encoding.Utf8, max_character_count=1000
+_codecs = {
+    reven2.types.Encoding.Utf8: "utf-8",
+    reven2.types.Encoding.Utf16: "utf-16-le",
+}
+
+
+def get_string_arg(point, address_offset, cr3=None):
+    return _read_string_before(
+        point, address_offset, reven2.types.Encoding.Utf8, cr3
     )
-    return _read_string_before(point, address_offset, String1000)
 
 
-def get_wstring_arg(point, address_offset):
-    WString1000 = reven2.types.CString(
-        encoding=reven2.types.Encoding.Utf16, max_character_count=1000
+def get_wstring_arg(point, address_offset, cr3=None):
+    return _read_string_before(
+        point, address_offset, reven2.types.Encoding.Utf16, cr3
     )
-    return _read_string_before(point, address_offset, WString1000)
 
 
 def ret_access(point, logical):
@@ -113,16 +161,28 @@ def _stack_pointer(context):
     return reven2.arch.x64.rsp if context.is64b() else reven2.arch.x64.esp
 
 
+def _program_counter(context):
+    return reven2.arch.x64.rip if context.is64b() else reven2.arch.x64.eip
+
+
 def _ret_value(context, raw=False):
     reg = reven2.arch.x64.rax if context.is64b() else reven2.arch.x64.eax
     return context.read(reg, raw=raw)
 
 
-def get_ret_point(point):
+def get_ret_point(point, resolver=None):
+    """Return the transition reading the return address pushed at point.
+
+    If given, the memory history lookup is done by the
+    ret_access.RetAccessResolver resolver.
+    """
     logical = read_reg_after(point, _stack_pointer_after(point), raw=False)
 
     try:
-        ret_point = ret_access(point, logical)
+        if resolver is None:
+            ret_point = ret_access(point, logical)
+        else:
+            ret_point = resolver.ret_access(point, logical)
     except RuntimeError as e:
         printerr("WAR: Cannot get ret point for `{}`: {}".format(point, e))
         return None
@@ -134,6 +194,73 @@ def get_ret_point(point):
     return ret_point
 
 
+def get_call_frame(point):
+    """Return (stack pointer, pc) expected when the call at point returns"""
+    context = point.context_after()
+    logical = context.read(_stack_pointer(context), raw=False)
+    ptr_size = 8 if context.is64b() else 4
+    ret_address = struct.unpack(
+        "<Q" if ptr_size == 8 else "<I",
+        context.read(
+            reven2.address.LogicalAddress(logical), ptr_size, raw=True
+        ),
+    )[0]
+    return (logical + ptr_size, ret_address)
+
+
+# bytes of arguments a callee may pop when returning, with `ret N`
+MAX_ARG_BYTES = 0x200
+
+
+def frame_returns(frame, call_frame):
+    """Return whether the (stack pointer, pc) frame returns from the call
+    of call_frame, as returned by get_call_frame.
+
+    Callee-cleaned calls, such as x86 stdcall, return with up to
+    MAX_ARG_BYTES of arguments popped.
+    """
+    sp, pc = frame
+    ret_sp, ret_address = call_frame
+    return pc == ret_address and ret_sp <= sp <= ret_sp + MAX_ARG_BYTES
+
+
+def get_frame(context):
+    """Return (stack pointer, pc) at context"""
+    return (
+        context.read(_stack_pointer(context), raw=False),
+        context.read(_program_counter(context), raw=False),
+    )
+
+
+def get_stack_key(context):
+    """Return (cr3, thread block) of the thread running at context.
+
+    The thread block is the fs or gs base, which points to the TEB of the
+    running thread in user mode and to the processor block in kernel mode.
+    """
+    return (
+        context.read(reven2.arch.x64.cr3, raw=False),
+        context.read(
+            reven2.arch.x64.gs_base
+            if context.is64b()
+            else reven2.arch.x64.fs_base,
+            raw=False,
+        ),
+    )
+
+
+def get_reentry_ret_point(point, reentry):
+    """Return the ret transition if reentry returns from the call at point.
+
+    The call returns at reentry if it is at the pushed return address,
+    with the return address and the arguments popped by the callee, if
+    any, popped from the stack.
+    """
+    if not frame_returns(get_frame(reentry), get_call_frame(point)):
+        return None
+    return reentry.transition_before()
+
+
 def get_ret_raw_value(ret_point):
     return _ret_value(ret_point.context_before(), raw=True)
 
@@ -145,62 +272,3 @@ def get_ret_int_value(ret_point):
         return struct.unpack("<q", raw_result)[0]
 
     return struct.unpack("<i", raw_result)[0]
-
-
-# TODO XMM0-3
-# TODO arg type
-def ms_x64_args(context, raw=False):
-    # RCX/XMM0
-    yield context.read(reven2.arch.x64.rcx, raw=raw)
-    # RDX/XMM1
-    yield context.read(reven2.arch.x64.rdx, raw=raw)
-    # R8/XMM2
-    yield context.read(reven2.arch.x64.r8, raw=raw)
-    # R9/XMM3
-    yield context.read(reven2.arch.x64.r9, raw=raw)
-
-    # stack shadow + ret address
-    # XXX: wrong if context is before the call
-    stack_offset = 32 + 8
-    while True:
-        # TODO arg type, stack aligned on 16bytes
-        size = 8
-        rsp_value = context.read(reven2.arch.x64.rsp, raw=False)
-        address = reven2.address.LogicalAddress(rsp_value + stack_offset)
-        try:
-            yield context.read(address, size, raw=raw)
-        except RuntimeError as e:
-            printerr(
-                "WAR: Cannot read memory arg at {}: {}".format(
-                    context.transition_before(), e
-                )
-            )
-            yield None
-        stack_offset += size
-
-
-# TODO [XYZ]MM0-7
-# TODO arg type
-def sysv_amd64_args(context, raw=False):
-    # RDI
-    yield context.read(reven2.arch.x64.rdi, raw=raw)
-    # RSI
-    yield context.read(reven2.arch.x64.rsi, raw=raw)
-    # RDX
-    yield context.read(reven2.arch.x64.rdx, raw=raw)
-    # RCX
-    yield context.read(reven2.arch.x64.rcx, raw=raw)
-    # R8
-    yield context.read(reven2.arch.x64.r8, raw=raw)
-    # R9
-    yield context.read(reven2.arch.x64.r9, raw=raw)
-
-    # XXX: wrong if context is before the call
-    stack_offset = 8
-    while True:
-        # TODO arg type, stack aligned on 16bytes
-        size = 8
-        rsp_value = context.read(reven2.arch.x64.rsp, raw=False)
-        address = reven2.address.LogicalAddress(rsp_value + stack_offset)
-        yield context.read(address, size, raw=raw)
-        stack_offset += size
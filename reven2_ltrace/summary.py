@@ -0,0 +1,165 @@
+"""Per-function summary of calls, like `ltrace -c`
+
+Calls are counted per binary!function with the number of transitions
+between each call and its ret point, and the failures by return value.
+Arguments are neither read nor formatted.
+"""
+
+import array
+import collections
+
+from .prototype_formatter import as_int_value
+
+
+# percentiles of the call durations, in transitions
+PERCENTILES = (50, 90, 99)
+
+# number of failure return values displayed per function
+MAX_FAILURE_VALUES = 3
+
+# columns of the summary table, distances are in transitions
+COLUMNS = (
+    ("calls", "errors", "total", "min")
+    + tuple("p{}".format(percent) for percent in PERCENTILES)
+    + ("max", "unpaired", "function", "failures")
+)
+
+# return formats for which 0 is a failure, such as FALSE or NULL
+_ZERO_FAILURE_FORMATS = (
+    "bool",
+    "addr",
+    "string",
+    "cstring",
+    "wstring",
+    "tstring",
+)
+
+
+def failure_value(raw_value, return_type):
+    """Return the signed return value if it is a failure, None otherwise.
+
+    Failures are 0 for booleans, pointers and strings, and negative values
+    otherwise.
+    """
+    if raw_value is None or return_type.format in (None, "void"):
+        return None
+
+    if return_type.size and return_type.size < len(raw_value):
+        raw_value = raw_value[: return_type.size]  # noqa: E203
+    value = as_int_value(raw_value)
+    if return_type.format in _ZERO_FAILURE_FORMATS:
+        return value if value == 0 else None
+    return value if value < 0 else None
+
+
+def _percentile(sorted_values, percent):
+    # nearest rank
+    rank = -(-len(sorted_values) * percent // 100)
+    return sorted_values[max(rank, 1) - 1]
+
+
+class FunctionSummary(object):
+    __slots__ = ("calls", "unpaired", "distances", "failures")
+
+    def __init__(self):
+        self.calls = 0
+        self.unpaired = 0
+        self.distances = array.array("q")
+        self.failures = collections.Counter()
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.unpaired += other.unpaired
+        self.distances.extend(other.distances)
+        self.failures.update(other.failures)
+
+
+class CallSummary(object):
+    """Summary of the calls added, mergeable across parallel workers"""
+
+    def __init__(self):
+        self._functions = {}
+
+    def add(self, call):
+        """Count the pretty.CallRecord call"""
+        name = "{}!{}".format(call.tr.to_bin, call.func)
+        function = self._functions.get(name)
+        if function is None:
+            function = self._functions[name] = FunctionSummary()
+
+        function.calls += 1
+        ret = call.ret
+        ret_point = ret.point
+        if ret_point is None:
+            function.unpaired += 1
+            return
+
+        function.distances.append(ret_point.id - call.point.id)
+        value = failure_value(ret.raw, call.proto.return_type)
+        if value is not None:
+            function.failures[value] += 1
+
+    def merge(self, other):
+        for name, function in other._functions.items():
+            if name in self._functions:
+                self._functions[name].merge(function)
+            else:
+                self._functions[name] = function
+
+    def rows(self):
+        """Return a tuple of COLUMNS per function, by decreasing total
+        distance
+        """
+        rows = []
+        for name, function in self._functions.items():
+            distances = sorted(function.distances)
+            if distances:
+                stats = (
+                    [sum(distances), distances[0]]
+                    + [_percentile(distances, p) for p in PERCENTILES]
+                    + [distances[-1]]
+                )
+            else:
+                stats = [0] + [None] * (len(PERCENTILES) + 2)
+            failures = " ".join(
+                "{}:{}".format(value, count)
+                for value, count in function.failures.most_common(
+                    MAX_FAILURE_VALUES
+                )
+            )
+            rows.append(
+                tuple(
+                    [function.calls, sum(function.failures.values())]
+                    + stats
+                    + [function.unpaired, name, failures]
+                )
+            )
+
+        rows.sort(key=lambda row: (-row[2], -row[0], row[-2]))
+        return rows
+
+    def print_table(self, file=None):
+        """Print the table of the functions called"""
+        rows = [
+            ["-" if value is None else str(value) for value in row]
+            for row in self.rows()
+        ]
+        widths = [
+            max([len(column)] + [len(row[i]) for row in rows])
+            for i, column in enumerate(COLUMNS)
+        ]
+
+        def line(cells):
+            # numbers are right aligned, names and failures left aligned
+            return " ".join(
+                [
+                    cell.rjust(width)
+                    for cell, width in zip(cells[:-2], widths[:-2])
+                ]
+                + [cells[-2].ljust(widths[-2]), cells[-1]]
+            ).rstrip()
+
+        print(line(COLUMNS), file=file)
+        print(line(["-" * width for width in widths]), file=file)
+        for row in rows:
+            print(line(row), file=file)
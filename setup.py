@@ -26,6 +26,7 @@ setuptools.setup(
     include_package_data=True,
     python_requires=">=3.5.3",
     install_requires=install_requires,
+    extras_require={"table": ["numpy"]},
     entry_points={
         "console_scripts": ["reven2-ltrace=reven2_ltrace.ltrace:main"]
     },
@@ -0,0 +1,84 @@
+"""Reading arguments through the argument plans"""
+
+import struct
+
+import pytest
+
+reven2 = pytest.importorskip("reven2")
+
+from reven2_ltrace import cache  # noqa: E402
+from reven2_ltrace.prototypes.ltraceconf.ltraceconf import (  # noqa: E402
+    LTraceConf,
+)
+from reven2_ltrace.reven import arg_plans  # noqa: E402
+from reven2_ltrace.reven import reven_helper as rvnh  # noqa: E402
+
+_x64 = reven2.arch.x64
+
+POINTER = 0x7FF6_1234_5678
+
+
+class Context(object):
+    def __init__(self, registers):
+        self._registers = registers
+
+    def read(self, reg, raw=False):
+        return self._registers[reg]
+
+
+class Point(object):
+    def __init__(self, registers):
+        self._context = Context(registers)
+
+    def context_before(self):
+        return self._context
+
+
+@pytest.fixture
+def conf(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "cache_root", None)
+    path = tmp_path / "ltrace.conf"
+    path.write_text("int f(addr, int, file, addr, addr);\n")
+    return LTraceConf(str(path))
+
+
+def test_ltrace_conf_pointers_keep_x64_width(conf, monkeypatch):
+    stack = []
+
+    def stack_args(point, offset, sizes):
+        stack.append((offset, sizes))
+        return [struct.pack("<Q", POINTER + 4)]
+
+    monkeypatch.setattr(rvnh, "get_raw_stack_args", stack_args)
+    point = Point(
+        {
+            _x64.rcx: struct.pack("<Q", POINTER),
+            _x64.rdx: struct.pack("<Q", 0xFFFF_FFFF_0000_0007),
+            _x64.r8: struct.pack("<Q", POINTER + 2),
+            _x64.r9: struct.pack("<Q", POINTER + 3),
+        }
+    )
+
+    plan = arg_plans.get_plan(conf.get_proto("f"), arg_plans.MS_X64)
+    values = plan.read(point)
+
+    assert [struct.unpack("<Q", value)[0] for value in values[::2]] == [
+        POINTER,
+        POINTER + 2,
+        POINTER + 4,
+    ]
+    assert values[1] == struct.pack("<i", 7)
+    assert values[3] == struct.pack("<Q", POINTER + 3)
+    assert stack == [(32 + 8, (8,))]
+
+
+def test_ltrace_conf_pointers_use_x86_slots(conf, monkeypatch):
+    monkeypatch.setattr(
+        rvnh,
+        "get_raw_stack_args",
+        lambda point, offset, sizes: [struct.pack("<I", 0x1000)] * len(sizes),
+    )
+    plan = arg_plans.get_plan(conf.get_proto("f"), arg_plans.X86_STACK)
+
+    assert plan.stack_sizes == (4, 4, 4, 4, 4)
+    assert len(plan.read(Point({}))[4]) == 4
@@ -0,0 +1,119 @@
+"""Selecting the calls by binary and symbol name"""
+
+import types
+
+import pytest
+
+from reven2_ltrace.call_filter import UNKNOWN, CallFilter, parse_pattern
+
+
+def call(binary, symbol):
+    location = (
+        None
+        if binary is None
+        else types.SimpleNamespace(binary=types.SimpleNamespace(name=binary))
+    )
+    return types.SimpleNamespace(
+        location=location,
+        symbol=None if symbol is None else types.SimpleNamespace(name=symbol),
+    )
+
+
+@pytest.mark.parametrize(
+    "pattern, binary, symbol, matches",
+    [
+        ("CreateFileW", "kernel32.dll", "CreateFileW", True),
+        ("createfile*", "kernel32.dll", "CreateFileW", True),
+        ("CreateFile", "kernel32.dll", "CreateFileW", False),
+        ("kernel32!*File*", "kernel32.dll", "ReadFile", True),
+        ("kernel32!*File*", "ntdll.dll", "NtReadFile", False),
+        ("/^ntdll!Nt/", "ntdll.dll", "NtReadFile", True),
+        ("/^ntdll!Nt/", "ntdll.dll", "RtlAllocateHeap", False),
+        ("/Heap$/", "ntdll.dll", "RtlAllocateHeap", True),
+        ("/^NTDLL!/", "ntdll.dll", "NtReadFile", False),
+    ],
+)
+def test_parse_pattern(pattern, binary, symbol, matches):
+    exclude, match = parse_pattern(pattern)
+
+    assert not exclude
+    assert match(binary, symbol) == matches
+
+
+def test_parse_exclude_pattern():
+    exclude, match = parse_pattern("!*Heap*")
+
+    assert exclude
+    assert match("ntdll.dll", "RtlAllocateHeap")
+
+
+@pytest.mark.parametrize("pattern", ["", "!", "/(/", "!/[a-/"])
+def test_invalid_patterns(pattern):
+    with pytest.raises(ValueError):
+        parse_pattern(pattern)
+
+
+@pytest.mark.parametrize(
+    "pattern", ["kernel32!CreateFileW", "KERNEL32.DLL!CreateFileW"]
+)
+@pytest.mark.parametrize("binary", ["kernel32.dll", "kernel32"])
+def test_binary_names_with_or_without_extension(pattern, binary):
+    _, match = parse_pattern(pattern)
+
+    assert match(binary, "CreateFileW")
+    assert not match("kernelbase.dll", "CreateFileW")
+
+
+@pytest.mark.parametrize("binary", ["kernel32.dll", "kernel32"])
+def test_regexes_match_binary_names_without_extension(binary):
+    _, match = parse_pattern("/^kernel32!Create/")
+
+    assert match(binary, "CreateFileW")
+
+
+def test_extension_is_not_ignored_when_the_binary_has_one():
+    _, match = parse_pattern("kernel32.dll!*")
+
+    assert not match("kernel32.exe", "CreateFileW")
+    assert not match("kernel32.dll.mui", "CreateFileW")
+
+
+def test_includes_and_excludes():
+    call_filter = CallFilter(["kernel32!*", "!*Heap*"])
+
+    assert call_filter.selects(call("kernel32.dll", "CreateFileW"))
+    assert not call_filter.selects(call("kernel32.dll", "HeapAlloc"))
+    assert not call_filter.selects(call("ntdll.dll", "NtReadFile"))
+    assert call_filter.rejected == 2
+
+
+def test_excludes_only():
+    call_filter = CallFilter(["!ntdll!*"])
+
+    assert call_filter.selects(call("kernel32.dll", "CreateFileW"))
+    assert not call_filter.selects(call("ntdll", "NtReadFile"))
+
+
+def test_symbols_are_demangled():
+    call_filter = CallFilter(["CreateFileW"])
+
+    assert call_filter.selects(call("kernel32.dll", "_CreateFileW@28"))
+
+
+def test_unknown_binary_and_symbol():
+    call_filter = CallFilter(["kernel32!Create*"])
+
+    assert not call_filter.selects(call(None, "CreateFileW"))
+    assert not call_filter.selects(call("kernel32.dll", None))
+    assert CallFilter([UNKNOWN]).selects(call("kernel32.dll", None))
+    assert call_filter.rejected == 2
+
+
+def test_rejected_calls_are_counted_once_resolved():
+    call_filter = CallFilter(["CreateFileW"])
+
+    for _ in range(3):
+        call_filter.selects(call("kernel32.dll", "ReadFile"))
+
+    assert call_filter.rejected == 3
+    assert list(call_filter._selected.values()) == [False]
@@ -0,0 +1,25 @@
+"""Split of the trace in shards for the parallel workers"""
+
+import pytest
+
+pytest.importorskip("reven2")
+
+from reven2_ltrace import parallel  # noqa: E402
+
+
+def test_shards_cover_the_range(monkeypatch):
+    monkeypatch.setattr(parallel, "MIN_SHARD_TRANSITIONS", 10)
+    shards = parallel.split_shards(5, 105, 2)
+
+    assert len(shards) == 10
+    assert shards[0][0] == 5 and shards[-1][1] == 105
+    assert all(a[1] == b[0] for a, b in zip(shards, shards[1:]))
+
+
+def test_small_range_is_one_shard():
+    assert parallel.split_shards(0, 10, 4) == [(0, 10)]
+
+
+@pytest.mark.parametrize("from_id, to_id", [(10, 10), (20, 10)])
+def test_empty_range_has_no_shard(from_id, to_id):
+    assert parallel.split_shards(from_id, to_id, 4) == []
@@ -0,0 +1,161 @@
+"""Persistent index of binary ranges, without a reven server"""
+
+import io
+import types
+
+import pytest
+
+from reven2_ltrace import cache
+from reven2_ltrace.reven import range_index
+from reven2_ltrace.reven.range_index import BinaryRangesIndex, _Interval
+
+
+TRANSITION_COUNT = 100
+
+# (enter, leave) context ids of the binary in the whole trace, the first
+# one is left right at the border of the first index window
+BOUNDARIES = [(10, 16), (30, 45), (90, None)]
+
+
+class Context(object):
+    def __init__(self, id):
+        self._id = id
+
+    def __sub__(self, count):
+        return Context(self._id - count)
+
+
+class Trace(object):
+    transition_count = TRANSITION_COUNT
+
+    def _context(self, id):
+        return Context(id)
+
+    def context_after(self, transition_id):
+        return Context(transition_id + 1)
+
+
+class Index(BinaryRangesIndex):
+    """Index searching BOUNDARIES, recording the searched intervals"""
+
+    def __init__(self, index_path):
+        self.scans = []
+        super(Index, self).__init__(
+            Trace(), "trace", "c:/a.dll", index_path=index_path
+        )
+
+    def _scan(self, lo, hi):
+        self.scans.append((lo, hi))
+        pairs = [
+            [max(enter, lo), None if leave is None or leave >= hi else leave]
+            for enter, leave in BOUNDARIES
+            if enter < hi and (leave is None or leave > lo)
+        ]
+        return _Interval(lo, hi, pairs)
+
+
+@pytest.fixture(autouse=True)
+def small_windows(monkeypatch):
+    monkeypatch.setattr(range_index, "INDEX_WINDOW", 16)
+
+
+@pytest.fixture
+def warnings(monkeypatch):
+    stderr = io.StringIO()
+    monkeypatch.setattr(range_index, "stderr", stderr)
+    return stderr
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    return str(tmp_path / "ranges.idx")
+
+
+def ranges(index, lo=None, hi=None):
+    return [
+        (first._id, last._id)
+        for first, last in index.ranges(
+            None if lo is None else Context(lo),
+            None if hi is None else Context(hi),
+        )
+    ]
+
+
+def test_ranges_of_the_whole_trace(index_path):
+    index = Index(index_path)
+
+    assert ranges(index) == [(10, 15), (30, 44), (90, TRANSITION_COUNT)]
+    assert index.scans == [(0, 16), (16, 48), (48, 100)]
+
+
+def test_ranges_of_a_sub_range(index_path):
+    assert ranges(Index(index_path), 12, 40) == [(12, 15), (30, 39)]
+
+
+def test_intervals_are_merged_across_windows(index_path):
+    index = Index(index_path)
+    index.update(0, 16)
+    index.update(16, 32)
+    index.update(32, 100)
+
+    assert [(i.lo, i.hi) for i in index._intervals] == [(0, 100)]
+    assert index._intervals[0].pairs == [[10, 16], [30, 45], [90, None]]
+
+
+def test_only_gaps_are_searched(index_path):
+    index = Index(index_path)
+    index.update(0, 40)
+    index.update(60, 80)
+    del index.scans[:]
+
+    index.update(0, 100)
+
+    assert index.scans == [(40, 60), (80, 100)]
+    assert [(i.lo, i.hi) for i in index._intervals] == [(0, 100)]
+
+
+def test_saved_index_is_reloaded(index_path):
+    Index(index_path).update(0, 100)
+
+    index = Index(index_path)
+
+    assert ranges(index) == [(10, 15), (30, 44), (90, TRANSITION_COUNT)]
+    assert index.scans == []
+
+
+def test_other_version_is_ignored(index_path, monkeypatch, warnings):
+    Index(index_path).update(0, 100)
+    monkeypatch.setattr(cache, "CACHE_VERSION", cache.CACHE_VERSION + 1)
+
+    index = Index(index_path)
+
+    assert index._intervals == []
+    assert "WAR: Ignoring ranges index" in warnings.getvalue()
+
+
+def test_truncated_index_is_ignored(index_path, warnings):
+    Index(index_path).update(0, 100)
+    with open(index_path, "rb") as f:
+        data = f.read()
+    with open(index_path, "wb") as f:
+        f.write(data[:-4])
+
+    index = Index(index_path)
+
+    assert index._intervals == []
+    assert ranges(index, 0, 20) == [(10, 15)]
+    assert "WAR: Ignoring ranges index" in warnings.getvalue()
+
+
+def test_index_path_depends_on_the_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "cache_root", str(tmp_path))
+
+    def path(processes=None):
+        return range_index._index_path("trace", "C:/A.dll", processes)
+
+    assert path() == range_index._index_path("trace", "c:/a.dll")
+    assert path() != path(types.SimpleNamespace(key="1234\0None"))
+    assert path().startswith(str(tmp_path))
+
+    monkeypatch.setattr(cache, "cache_root", None)
+    assert path() is None
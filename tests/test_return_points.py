@@ -0,0 +1,143 @@
+"""Pairing of calls with their reentry by stack frame"""
+
+import pytest
+
+reven2 = pytest.importorskip("reven2")
+
+from reven2_ltrace.reven import reven_helper as rvnh  # noqa: E402
+from reven2_ltrace.reven.return_points import pair_stack_depth  # noqa: E402
+
+
+# (cr3, thread block) of the thread of the contexts
+THREAD = (0x1AA000, 0x7FFDE000)
+
+
+class Transition(object):
+    def __init__(self, id, call_frame=None, thread=THREAD):
+        self.id = id
+        self.type = reven2.trace.TransitionType.Instruction
+        self.call_frame = call_frame
+        self.thread = thread
+
+    def context_before(self):
+        return Context(self.id, thread=self.thread)
+
+
+class Context(object):
+    """Context at id, with the (sp, pc) frame of a reentry, or the frame
+    expected at the return of the call made after it
+    """
+
+    def __init__(self, id, frame=None, call_frame=None, thread=THREAD):
+        self._id = id
+        self.frame = frame
+        self.call_frame = call_frame
+        self.thread = thread
+
+    def transition_before(self):
+        return Transition(self._id - 1, thread=self.thread)
+
+    def transition_after(self):
+        return Transition(self._id, self.call_frame, self.thread)
+
+
+class Trace(object):
+    transition_count = 1000
+
+
+# last context of the trace, not followed by a call
+END = Context(Trace.transition_count)
+
+
+@pytest.fixture(autouse=True)
+def frames(monkeypatch):
+    monkeypatch.setattr(rvnh, "get_frame", lambda context: context.frame)
+    monkeypatch.setattr(rvnh, "get_call_frame", lambda call: call.call_frame)
+    monkeypatch.setattr(rvnh, "get_stack_key", lambda context: context.thread)
+
+
+def pair(*ranges):
+    return [
+        (call.id, None if ret is None else ret.id, depth)
+        for call, ret, depth in pair_stack_depth(Trace(), ranges)
+    ]
+
+
+def test_cdecl_returns_with_arguments_on_stack():
+    assert pair(
+        (Context(0), Context(10, call_frame=(0x1000, 0x401005))),
+        (Context(20, frame=(0x1000, 0x401005)), END),
+    ) == [(10, 19, 0)]
+
+
+def test_stdcall_returns_with_arguments_popped():
+    assert pair(
+        (Context(0), Context(10, call_frame=(0x1000, 0x401005))),
+        (Context(20, frame=(0x1000 + 3 * 4, 0x401005)), END),
+    ) == [(10, 19, 0)]
+
+
+def test_nested_callback():
+    assert pair(
+        (Context(0), Context(10, call_frame=(0x1000, 0x401005))),
+        # callback called by the first call
+        (
+            Context(20, frame=(0xE00, 0x402000)),
+            Context(30, call_frame=(0xDF0, 0x402010)),
+        ),
+        # the second call returns to the callback
+        (
+            Context(40, frame=(0xDF0 + 8, 0x402010)),
+            Context(50, call_frame=(0xDFC, 0x402020)),
+        ),
+        # the first call returns, unwinding the callback
+        (Context(60, frame=(0x1000 + 8, 0x401005)), END),
+    ) == [(10, 59, 0), (30, 39, 1), (50, None, 1)]
+
+
+def test_threads_with_close_stacks():
+    other = (0x1AA000, 0x7FFDB000)
+    assert pair(
+        (Context(0), Context(10, call_frame=(0x1000, 0x401005))),
+        # another thread, whose stack is right above, enters the binary
+        (
+            Context(20, frame=(0x9000, 0x402000), thread=other),
+            Context(30, call_frame=(0x8F00, 0x402010), thread=other),
+        ),
+        (Context(40, frame=(0x1000, 0x401005)), END),
+    ) == [(10, 39, 0), (30, None, 0)]
+
+
+def test_processes_with_same_stack_addresses():
+    other = (0x2BB000, 0x7FFDE000)
+    assert pair(
+        (Context(0), Context(10, call_frame=(0x1000, 0x401005))),
+        (
+            Context(20, frame=(0x1000, 0x401005), thread=other),
+            Context(30, call_frame=(0x1000, 0x401005), thread=other),
+        ),
+        (Context(40, frame=(0x1000, 0x401005)), END),
+    ) == [(10, 39, 0), (30, None, 0)]
+
+
+def test_unwound_call_is_released():
+    calls = pair_stack_depth(
+        Trace(),
+        iter(
+            [
+                (Context(0), Context(10, call_frame=(0x1000, 0x401005))),
+                (Context(20, frame=(0x8000, 0x401100)), END),
+            ]
+        ),
+    )
+    call, ret, _ = next(calls)
+    assert (call.id, ret) == (10, None)
+
+
+def test_reentry_pairing_of_stdcall():
+    call = Transition(10, call_frame=(0x1000, 0x401005))
+    reentry = Context(20, frame=(0x1000 + 2 * 4, 0x401005))
+    assert rvnh.get_reentry_ret_point(call, reentry).id == 19
+
+    callback = Context(20, frame=(0xE00, 0x401005))
+    assert rvnh.get_reentry_ret_point(call, callback) is None